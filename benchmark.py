@@ -0,0 +1,355 @@
+"""
+Time the tutorial's three examples against a recorded stand-in for lsproxy.
+
+Record the requests the examples make once, against a running lsproxy and a checkout of the workspace:
+
+    python benchmark.py record --base-url http://localhost:4444/v1 --workspace /mnt/workspace
+
+Then replay them as often as you like, without lsproxy, to compare changes against each other:
+
+    python benchmark.py run --latency 0.005 --repeat 5
+
+Add --base-url to replay over HTTP, through a stand-in server from `lsproxy_recording.py serve`.
+
+To time how long the tutorial takes to open, running every cell that runs before anything is clicked:
+
+    python benchmark.py startup --latency 0.005
+
+The examples run through the tutorial's own code: `BlastRadius`, in front of the same stack of caches
+the tutorial puts around its client (`lsproxy_cache.wrap_client`), starting empty on every repeat.
+Pass --workspace to `run` to include the caches that need a checkout, the disk cache and the index.
+
+For each example this reports the wall time (p50/p95 over the repeats), the number of requests of each
+kind that got past the caches, their latency (p50/p95), the throughput in requests per second, and the
+peak memory allocated.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from lsproxy import GetReferencesRequest
+
+from blast_radius import BlastRadius, PropagationLimits
+from git_diff import git_diff_command, parse_diff
+from lsproxy_cache import wrap_client
+from lsproxy_recording import Recording, RecordingClient, ReplayLsproxy, make_server
+from lsproxy_transport import PooledLsproxy
+from workspace_index import Workspace
+
+# The files the tutorial's Example 1 dropdowns start on
+EXAMPLE_1_FILES = [
+    "server/src/handlers/chunk_handler.rs",
+    "frontends/search/src/hooks/useSearch.ts",
+]
+# Example 3's diff is against this commit, the parent of https://github.com/devflowinc/trieve/pull/2649
+EXAMPLE_3_PARENT_COMMIT = "1910d6867877bfdd64ca822e266372335392a8be"
+EXAMPLE_3_MAX_NODES = 500
+
+
+class MeasuredClient:
+    """Pass calls through to an lsproxy client, timing each one."""
+
+    def __init__(self, client):
+        self._client = client
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+
+    def _call(self, kind: str, *args):
+        started = time.perf_counter()
+        try:
+            return getattr(self._client, kind)(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.latencies.setdefault(kind, []).append(elapsed)
+
+    def definitions_in_file(self, file_path):
+        return self._call("definitions_in_file", file_path)
+
+    def find_references(self, request):
+        return self._call("find_references", request)
+
+    def read_source_code(self, request):
+        return self._call("read_source_code", request)
+
+    def list_files(self):
+        return self._call("list_files")
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """The nearest-rank percentile of `values`, e.g. fraction=0.95 for p95."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def example_1(client, workers: int):
+    """
+    Example 1: list the symbols in a file, then read the code of and find the references to each one,
+    as if every symbol in the table was clicked in turn.
+    """
+    for file_path in EXAMPLE_1_FILES:
+        for symbol in client.definitions_in_file(file_path):
+            client.read_source_code(symbol.range)
+            client.find_references(
+                GetReferencesRequest(
+                    identifier_position=symbol.identifier_position, include_code_context_lines=2
+                )
+            )
+
+
+def example_2(client, workers: int, files: List[str]):
+    """
+    Example 2: find which symbols in each of `files` the other files reference, looking up the references
+    to every symbol in a file `workers` at a time.
+    """
+    blast_radius = BlastRadius(client, max_concurrent_requests=workers)
+    for file_path in files:
+        blast_radius.referenced_symbols_in_file(file_path)
+
+
+def example_3(client, workers: int, diff_text: str):
+    """
+    Example 3: find the symbols containing the lines a diff changes, then follow the references to them
+    level by level, up to EXAMPLE_3_MAX_NODES symbols.
+
+    Unlike the tutorial there's no time budget, so every run sends the same requests.
+    """
+    blast_radius = BlastRadius(client, max_concurrent_requests=workers)
+    changed_directly = blast_radius.symbols_changed_in(parse_diff(diff_text.splitlines()))
+    return blast_radius.propagate_changes_through_codebase(
+        changed_directly, limits=PropagationLimits(max_nodes=EXAMPLE_3_MAX_NODES)
+    )
+
+
+def workloads(recording: Recording, args) -> Dict[str, Callable]:
+    """The examples to run, as functions of a client."""
+    with open(args.file_options) as f:
+        example_2_files = [file for file, _ in json.load(f)][: args.example_2_files]
+    diff_text = recording.get("git_diff", EXAMPLE_3_PARENT_COMMIT)
+    return {
+        "example_1": lambda client: example_1(client, args.workers),
+        "example_2": lambda client: example_2(client, args.workers, example_2_files),
+        "example_3": lambda client: example_3(client, args.workers, diff_text),
+    }
+
+
+def record(args):
+    recording = Recording()
+    recording.add(
+        "git_diff",
+        EXAMPLE_3_PARENT_COMMIT,
+        subprocess.check_output(
+            git_diff_command(EXAMPLE_3_PARENT_COMMIT), cwd=args.workspace
+        ).decode("utf-8"),
+    )
+    client = RecordingClient(
+        PooledLsproxy(base_url=args.base_url, pool_size=args.workers), recording
+    )
+    for name, run in workloads(recording, args).items():
+        started = time.perf_counter()
+        # Through the same caches as `run`, so the recording has exactly the requests that get past them
+        run(wrap_client(client))
+        print(f"Recorded {name} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    recording.save(args.recording)
+    print(f"Saved {len(recording)} responses to {args.recording}", file=sys.stderr)
+    return 0
+
+
+def measure(run: Callable, make_client: Callable, repeat: int, workspace: Optional[Workspace] = None) -> dict:
+    """
+    Replay a workload `repeat` times, then once more under tracemalloc for its peak memory.
+
+    Each run gets a fresh `wrap_client` stack in front of `make_client()`, with an empty cache directory
+    if there's a `workspace`, and the requests that get past it are the ones counted and timed.
+    """
+    wall_times = []
+    latencies: Dict[str, List[float]] = {}
+    with tempfile.TemporaryDirectory() as cache_root:
+
+        def make_stack(client):
+            cache_dir = tempfile.mkdtemp(dir=cache_root) if workspace is not None else None
+            return wrap_client(client, workspace=workspace, cache_dir=cache_dir)
+
+        for _ in range(repeat):
+            client = MeasuredClient(make_client())
+            stack = make_stack(client)
+            started = time.perf_counter()
+            run(stack)
+            wall_times.append(time.perf_counter() - started)
+            for kind, values in client.latencies.items():
+                latencies.setdefault(kind, []).extend(values)
+
+        tracemalloc.start()
+        try:
+            run(make_stack(make_client()))
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "wall_seconds": {
+            "p50": percentile(wall_times, 0.5),
+            "p95": percentile(wall_times, 0.95),
+        },
+        "requests": {kind: len(values) // repeat for kind, values in sorted(latencies.items())},
+        "request_latency_ms": {
+            "p50": 1000 * percentile(all_latencies, 0.5),
+            "p95": 1000 * percentile(all_latencies, 0.95),
+        },
+        "requests_per_second": len(all_latencies) / sum(wall_times) if sum(wall_times) else 0.0,
+        "peak_memory_mb": peak_bytes / 2**20,
+    }
+
+
+def run(args):
+    recording = Recording.load(args.recording)
+    if args.base_url:
+        # Go through HTTP and the real client, e.g. to a `lsproxy_recording.py serve` stand-in
+        client = PooledLsproxy(base_url=args.base_url, pool_size=args.workers)
+
+        def make_client():
+            return client
+
+    else:
+
+        def make_client():
+            return ReplayLsproxy(recording, latency=args.latency)
+
+    workspace = Workspace(args.workspace) if args.workspace else None
+    results = {
+        name: measure(workload, make_client, args.repeat, workspace)
+        for name, workload in workloads(recording, args).items()
+        if not args.only or name in args.only
+    }
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return 0
+    for name, result in results.items():
+        print(
+            f"{name}: wall p50 {result['wall_seconds']['p50']:.3f}s p95 {result['wall_seconds']['p95']:.3f}s, "
+            f"requests {sum(result['requests'].values())} "
+            f"({', '.join(f'{kind} {count}' for kind, count in result['requests'].items())}), "
+            f"latency p50 {result['request_latency_ms']['p50']:.2f}ms p95 {result['request_latency_ms']['p95']:.2f}ms, "
+            f"{result['requests_per_second']:.0f} requests/s, peak memory {result['peak_memory_mb']:.1f}MB"
+        )
+    return 0
+
+
+def startup(args):
+    """
+    Time `marimo export html` of the tutorial against a stand-in lsproxy serving the recording.
+
+    Exporting runs every cell that runs when the tutorial is opened, so this is how long it takes to
+    become interactive, plus marimo's own start up, which is the same for any notebook. Like in the
+    Docker image, CHECKOUT_LOCATION is the checkout (--workspace), so the workspace version, the caches
+    on disk and the symbol count tables are all part of the measurement.
+    """
+    server = make_server(Recording.load(args.recording), port=0, latency=args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = dict(os.environ, BASE_URL=f"http://127.0.0.1:{server.server_address[1]}/v1")
+    env.pop("LSPROXY_RECORD", None)
+    if args.workspace:
+        env["CHECKOUT_LOCATION"] = args.workspace
+    wall_times = []
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                subprocess.run(
+                    [sys.executable, "-m", "marimo", "export", "html", args.notebook]
+                    + ["-o", os.path.join(output_dir, "tutorial.html")],
+                    env=env,
+                    check=True,
+                    capture_output=True,
+                )
+                wall_times.append(time.perf_counter() - started)
+    finally:
+        server.shutdown()
+        server.server_close()
+    result = {"wall_seconds": {"p50": percentile(wall_times, 0.5), "p95": percentile(wall_times, 0.95)}}
+    if args.json:
+        json.dump({"startup": result}, sys.stdout, indent=2)
+        print()
+    else:
+        print(f"startup: wall p50 {result['wall_seconds']['p50']:.3f}s p95 {result['wall_seconds']['p95']:.3f}s")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--recording",
+        default=os.path.join("bench", "recording.json.gz"),
+        help="Where the recorded responses are kept",
+    )
+    parser.add_argument("--workers", type=int, default=16, help="Concurrent requests")
+    parser.add_argument(
+        "--file-options",
+        default="file_options.json",
+        help="The files Example 2 crawls, in the tutorial's file_options.json format",
+    )
+    parser.add_argument(
+        "--example-2-files", type=int, default=None, help="Only crawl this many of the files in Example 2"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="Record the examples against a running lsproxy")
+    record_parser.add_argument("--base-url", default=os.environ.get("BASE_URL", "http://localhost:4444/v1"))
+    record_parser.add_argument("--workspace", default=os.environ.get("CHECKOUT_LOCATION"))
+
+    run_parser = subparsers.add_parser("run", help="Replay the examples and report how they performed")
+    run_parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds the stand-in waits before each response"
+    )
+    run_parser.add_argument(
+        "--base-url",
+        help="Replay through lsproxy's HTTP API at this URL instead of in process, "
+        "e.g. a stand-in from `python lsproxy_recording.py serve`",
+    )
+    run_parser.add_argument(
+        "--workspace",
+        help="A checkout of the recorded workspace, to also go through the disk cache and the index",
+    )
+    run_parser.add_argument("--repeat", type=int, default=5, help="Times to run each example")
+    run_parser.add_argument(
+        "--only", nargs="+", choices=["example_1", "example_2", "example_3"], help="Examples to run"
+    )
+    run_parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+    startup_parser = subparsers.add_parser("startup", help="Time how long the tutorial takes to open")
+    startup_parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds the stand-in waits before each response"
+    )
+    startup_parser.add_argument("--notebook", default="tutorial.py")
+    startup_parser.add_argument(
+        "--workspace",
+        default=os.environ.get("CHECKOUT_LOCATION"),
+        help="The checkout the tutorial is opened on, as in production",
+    )
+    startup_parser.add_argument("--repeat", type=int, default=5, help="Times to open the tutorial")
+    startup_parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+    args = parser.parse_args()
+    if args.command == "startup":
+        return startup(args)
+    if args.command == "record":
+        if not args.workspace:
+            parser.error("record needs --workspace or CHECKOUT_LOCATION, to get Example 3's diff")
+        return record(args)
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1232 @@
+"""
+Find what a change touches, and follow it through the codebase, without the notebook.
+
+This is the analysis behind the tutorial's Examples 2 and 3, usable from scripts and CI. It needs lsproxy
+and a git checkout of the workspace lsproxy serves, but not marimo or openai:
+
+    # The blast radius of a PR's merge commit, and of uncommitted changes since a commit, as JSON
+    python blast_radius.py changes 1a2b3c4 1910d6867877bfdd64ca822e266372335392a8be..
+
+    # The same as Mermaid call graphs
+    python blast_radius.py changes 1a2b3c4 --format mermaid
+
+    # A feature branch's changes since it branched off main, as JSON and Mermaid reports in a directory
+    python blast_radius.py changes main...HEAD --output-dir reports/
+
+    # Which files reference the symbols defined in a file, like Example 2
+    python blast_radius.py references server/src/handlers/chunk_handler.rs --format mermaid
+
+`BlastRadius` finds the symbols containing changed lines or references and propagates changes through
+the code that references them; `parse_diff`, `generate_reference_diagram` and `hierarchy_to_mermaid`
+turn diffs and results into inputs and diagrams.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from lsproxy import FileRange, FilePosition, GetReferencesRequest
+from pydantic import BaseModel
+
+from git_diff import LineRanges, git_diff_lines, parse_diff, resolve_commit_range
+from lsproxy_transport import fan_out
+
+# The concurrency the tutorial uses, lsproxy's client keeps 20 keep-alive connections so stay under that
+MAX_CONCURRENT_REQUESTS = 16
+# Commit ranges analyzed at once in a batch. They split the concurrent requests between them
+BATCH_CONCURRENT_RANGES = 4
+
+
+class SymbolIndex:
+    """
+    Interval tree over the ranges of the symbols defined in one file.
+
+    The ranges are sorted by start and stored in flat arrays. The tree is implicit: the middle of any
+    slice of the arrays is the root of that slice, and `_max_end` keeps the furthest end position in
+    each subtree so whole subtrees that end before a position are skipped. Finding the symbols that
+    contain a position takes O(log n + k) for k matches, instead of checking every symbol.
+    Positions can be given as `Position` or `FilePosition`.
+    """
+
+    def __init__(self, symbols):
+        self.symbols = symbols
+        self._symbols = sorted(
+            symbols,
+            key=lambda symbol: (self._key(symbol.range.start), self._key(symbol.range.end)),
+        )
+        self._starts = [self._key(symbol.range.start) for symbol in self._symbols]
+        self._ends = [self._key(symbol.range.end) for symbol in self._symbols]
+        self._max_end = list(self._ends)
+        self._build_max_end(0, len(self._symbols))
+
+    @staticmethod
+    def _key(position):
+        # Compare positions as plain (line, character) tuples
+        position = getattr(position, "position", position)
+        return (position.line, position.character)
+
+    def _build_max_end(self, lo, hi):
+        # Fill in the furthest end of the subtree rooted at the middle of [lo, hi) and return it
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        for child_end in (self._build_max_end(lo, mid), self._build_max_end(mid + 1, hi)):
+            if child_end is not None and child_end > self._max_end[mid]:
+                self._max_end[mid] = child_end
+        return self._max_end[mid]
+
+    def _containing(self, key):
+        # Array indexes of the ranges that contain key, from outermost to innermost
+        found = []
+        stack = [(0, len(self._symbols))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self._max_end[mid] < key:
+                continue
+            stack.append((lo, mid))
+            # Everything right of mid starts at or after it, so it can only match if mid starts before key
+            if self._starts[mid] <= key:
+                if key <= self._ends[mid]:
+                    found.append(mid)
+                stack.append((mid + 1, hi))
+        # A later start is further in, and for equal starts the earlier end is further in
+        found.sort(key=lambda i: (self._starts[i], -self._ends[i][0], -self._ends[i][1]))
+        return found
+
+    def enclosing(self, position):
+        """All the symbols whose range contains `position`, from outermost to innermost."""
+        return [self._symbols[i] for i in self._containing(self._key(position))]
+
+    def innermost(self, position):
+        """The smallest symbol whose range contains `position`, or None."""
+        found = self._containing(self._key(position))
+        return self._symbols[found[-1]] if found else None
+
+    def enclosing_many(self, positions):
+        """All the symbols whose range contains at least one of `positions`, in the order they appear in the file."""
+        found = set()
+        for key in {self._key(position) for position in positions}:
+            found.update(self._containing(key))
+        return [self._symbols[i] for i in sorted(found)]
+
+    def innermost_many(self, positions):
+        """The innermost containing symbol (or None) for each of `positions`."""
+        innermost_by_key = {}
+        for key in {self._key(position) for position in positions}:
+            found = self._containing(key)
+            innermost_by_key[key] = self._symbols[found[-1]] if found else None
+        return [innermost_by_key[self._key(position)] for position in positions]
+
+    def overlapping_lines(self, line_ranges):
+        """
+        All the symbols containing the start of a line in `line_ranges`, in the order they appear in the file.
+
+        `line_ranges` are sorted, disjoint (first line, last line) pairs, like `LineRanges.ranges()`, with
+        lines counted from 0 like lsproxy's positions. This finds what `enclosing_many` would for a position at character 0 of every line in the ranges,
+        but sweeps the ranges and symbols together in one pass, so it takes O(n + ranges) however many
+        lines the ranges cover.
+        """
+        line_ranges = list(line_ranges)
+        found = []
+        next_range = 0
+        for i, (start, end) in enumerate(zip(self._starts, self._ends)):
+            # The first line whose start is inside the symbol. Symbols are sorted by start, so this never decreases
+            first_line = start[0] if start[1] == 0 else start[0] + 1
+            while next_range < len(line_ranges) and line_ranges[next_range][1] < first_line:
+                next_range += 1
+            if next_range == len(line_ranges):
+                break
+            # Later ranges start even further down, so this is the only one that can overlap. It ends at or
+            # after first_line, and has a line start in the symbol unless it starts past the symbol's end or,
+            # for a symbol starting mid-line, first_line is already past it
+            if max(line_ranges[next_range][0], first_line) <= end[0]:
+                found.append(self._symbols[i])
+        return found
+
+
+class SymbolGraph:
+    """
+    Directed graph of symbols, stored as integer arrays.
+
+    Each symbol is interned once, by where it's defined, and gets an integer ID: its index in `items`.
+    References are kept as two parallel arrays of IDs, and `adjacency()` packs them into compressed
+    sparse rows: `targets[offsets[i]:offsets[i + 1]]` are the IDs symbol i points to. Hashing a symbol
+    only happens when it's added or looked up, the diagrams and tables below walk the integer arrays.
+    """
+
+    def __init__(self):
+        self.items = []
+        self._ids = {}
+        self._sources = array("l")
+        self._targets = array("l")
+        self._adjacency = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item.key in self._ids
+
+    def add_node(self, item) -> int:
+        """Intern `item` and return its ID, the existing one if it's already in the graph."""
+        node_id = self._ids.get(item.key)
+        if node_id is None:
+            node_id = self._ids[item.key] = len(self.items)
+            self.items.append(item)
+            self._adjacency = None
+        return node_id
+
+    def id_of(self, item):
+        """The ID of `item`, or None if it isn't in the graph."""
+        return self._ids.get(item.key)
+
+    def add_edge(self, source: int, target: int):
+        """Add a reference from one ID to another."""
+        self._sources.append(source)
+        self._targets.append(target)
+        self._adjacency = None
+
+    @property
+    def edge_count(self) -> int:
+        return len(self._sources)
+
+    def edges(self):
+        """Iterate over the references as (source item, target item) pairs."""
+        items = self.items
+        for source, target in zip(self._sources, self._targets):
+            yield items[source], items[target]
+
+    def adjacency(self):
+        """
+        The references as compressed sparse rows, (offsets, targets).
+
+        Built with a counting sort over the edge arrays and cached until the graph changes.
+        """
+        if self._adjacency is None:
+            offsets = array("l", [0]) * (len(self.items) + 1)
+            for source in self._sources:
+                offsets[source + 1] += 1
+            for node_id in range(len(self.items)):
+                offsets[node_id + 1] += offsets[node_id]
+            targets = array("l", [0]) * len(self._targets)
+            next_slot = array("l", offsets[:-1])
+            for source, target in zip(self._sources, self._targets):
+                targets[next_slot[source]] = target
+                next_slot[source] += 1
+            self._adjacency = (offsets, targets)
+        return self._adjacency
+
+    def successors(self, node_id: int):
+        """The IDs `node_id` has references to."""
+        offsets, targets = self.adjacency()
+        return targets[offsets[node_id] : offsets[node_id + 1]]
+
+
+class HierarchyItem:
+    """
+    A symbol in the call graph.
+
+    There can be hundreds of thousands of these in a big graph, so they're plain `__slots__` records
+    compared by where the symbol is defined. The source code is kept by `source_reader`, which needs
+    `register` and `read` methods like the tutorial's `BatchedSourceReader`; without one `source_code`
+    isn't available.
+    """
+
+    __slots__ = ("name", "kind", "defined_at", "range", "key", "source_reader")
+
+    def __init__(
+        self, name: str, kind: str, defined_at: FilePosition, range: FileRange, source_reader=None
+    ):
+        self.name = name
+        self.kind = kind
+        self.defined_at = defined_at
+        self.range = range
+        # (path, line, character) of the symbol's identifier
+        self.key = defined_at.as_tuple
+        self.source_reader = source_reader
+        if source_reader is not None:
+            source_reader.register(range)
+
+    @property
+    def source_code(self) -> str:
+        if self.source_reader is None:
+            raise AttributeError("HierarchyItem was made without a source_reader, so it can't read its source code")
+        return self.source_reader.read(self.range)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, HierarchyItem) and self.key == other.key
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    def __repr__(self) -> str:
+        return f"HierarchyItem(name={self.name!r}, kind={self.kind!r}, defined_at={self.defined_at!r})"
+
+
+class PropagationLimits(BaseModel):
+    """Bounds on how far a change is followed through the codebase. None means unbounded."""
+
+    # Number of reference hops away from the symbols changed directly
+    max_depth: Optional[int] = None
+    # Total number of symbols in the result
+    max_nodes: Optional[int] = None
+    # Wall-clock time for the whole search
+    time_budget_seconds: Optional[float] = None
+    # Symbols followed into any one file from a single referenced symbol
+    max_symbols_per_file: Optional[int] = None
+
+
+class PropagationUpdate(NamedTuple):
+    # Symbols and references found since the previous update
+    nodes: Set[HierarchyItem]
+    edges: Set[Tuple[HierarchyItem, HierarchyItem]]
+    # Names of the PropagationLimits that have cut the search short so far
+    truncated_by: List[str]
+    # Everything found so far, this is the same SymbolGraph in every update and it keeps growing
+    graph: SymbolGraph
+
+
+class PropagationResult(NamedTuple):
+    graph: SymbolGraph
+    # Names of the PropagationLimits that cut the search short, empty if it ran to completion
+    truncated_by: List[str]
+
+    @property
+    def truncated(self) -> bool:
+        return bool(self.truncated_by)
+
+    # The graph as sets of items, built on every access, so prefer `graph` for anything big
+
+    @property
+    def nodes(self) -> Set[HierarchyItem]:
+        return set(self.graph.items)
+
+    @property
+    def edges(self) -> Set[Tuple[HierarchyItem, HierarchyItem]]:
+        return set(self.graph.edges())
+
+
+class RelatedSymbolsCache(dict):
+    """
+    Each symbol's related symbols, for passing to several searches so later ones only look up new symbols.
+
+    An entry depends on the symbol's own file, since an edit moves the symbols after it, and on the files
+    its related symbols are in, which is where the references to it were found. When `workspace.version`
+    changes, `forget_if_stale` checks each of those files' `file_version` and forgets just the entries
+    using one that changed, so after an edit only the symbols it touched are looked up again. A reference
+    added in a file none of them is in isn't noticed until that symbol is looked up for another reason.
+    Without a workspace the cache is never invalidated, like a plain dict.
+    """
+
+    def __init__(self, workspace=None):
+        super().__init__()
+        self.workspace = workspace
+        self.version = workspace.version if workspace is not None else None
+        # file path -> its file_version when the first entry using it was stored
+        self._file_versions = {}
+        self._lock = threading.Lock()
+
+    def __setitem__(self, symbol, related_symbols):
+        if self.workspace is not None:
+            paths = {symbol.defined_at.path} | {related.defined_at.path for related in related_symbols}
+            with self._lock:
+                for path in paths - self._file_versions.keys():
+                    self._file_versions[path] = self.workspace.file_version(path)
+        super().__setitem__(symbol, related_symbols)
+
+    def forget_if_stale(self) -> None:
+        if self.workspace is None:
+            return
+        version = self.workspace.version
+        with self._lock:
+            if version == self.version:
+                return
+            self.version = version
+            changed = {
+                path
+                for path, file_version in self._file_versions.items()
+                if self.workspace.file_version(path) != file_version
+            }
+            for path in changed:
+                del self._file_versions[path]
+            if not changed:
+                return
+            for symbol, related_symbols in list(self.items()):
+                if symbol.defined_at.path in changed or any(
+                    related.defined_at.path in changed for related in related_symbols
+                ):
+                    self.pop(symbol, None)
+
+
+# Past this many boxes mermaid takes seconds to lay a diagram out, so bigger graphs get collapsed
+MAX_DIAGRAM_NODES = 150
+MAX_DIAGRAM_EDGES = 300
+
+
+def cluster_paths(paths: List[str], max_clusters: int) -> Dict[str, str]:
+    """
+    Group file paths into at most `max_clusters` clusters, keeping the groups as fine as possible.
+
+    Each file is its own cluster if there are few enough of them, otherwise files are grouped by
+    their directory, then by the parent directories, up to a single cluster for the whole workspace.
+    Returns path -> cluster name, where a directory's cluster is named like "server/src/handlers/".
+    """
+    paths = set(paths)
+    if len(paths) <= max_clusters:
+        return {path: path for path in paths}
+    directories = {path: path.split("/")[:-1] for path in paths}
+    deepest = max(len(parts) for parts in directories.values())
+    for depth in range(deepest, -1, -1):
+        clusters = {
+            path: "/".join(parts[:depth]) + "/" if parts[:depth] else "./"
+            for path, parts in directories.items()
+        }
+        if len(set(clusters.values())) <= max_clusters:
+            return clusters
+    return clusters
+
+
+def generate_reference_diagram(
+    dependencies: dict, max_chars: int = 28, max_files: int = MAX_DIAGRAM_NODES
+) -> str:
+    """
+    Convert a dictionary of file dependencies and their referenced symbols into a Mermaid diagram string.
+    Arrows point from referenced file back to source file through reference nodes.
+    Args:
+        dependencies: Dict where keys are tuples of (defined_file, referenced_file) and values are sets of referenced symbols
+                     OR a string representing the root file path when there are no dependencies
+        max_chars: Maximum length for displayed file paths, truncating from left if needed
+        max_files: Maximum number of referencing files to draw, past that they're grouped by directory
+    Returns:
+        String containing the Mermaid diagram definition
+    """
+
+    def get_display_name(file_path: str) -> str:
+        """Get display name for a file, truncating from left if needed."""
+        if len(file_path) <= max_chars:
+            return file_path
+        return "..." + file_path[-(max_chars - 3) :]
+
+    # Handle case where dependencies is just a root file string
+    if isinstance(dependencies, str):
+        return f"""graph LR
+    root["{dependencies}"]
+    classDef default fill:#f9f9f9,stroke:#333,stroke-width:2px,color:#000;
+    classDef source fill:#e1f5fe,stroke:#0277bd,stroke-width:2px,color:#000;
+    class root source;"""
+
+    if not dependencies:
+        return "graph LR\n    %% No dependencies to display"
+
+    # Too many referencing files to draw one box each, so merge them into their directories
+    if len(dependencies) > max_files:
+        clusters = cluster_paths(
+            [referenced_file for _, referenced_file in dependencies], max_files
+        )
+        collapsed = {}
+        for (defined_file, referenced_file), symbols in dependencies.items():
+            collapsed.setdefault(
+                (defined_file, clusters[referenced_file]), set()
+            ).update(symbols)
+        dependencies = collapsed
+
+    mermaid_lines = ["graph LR"]
+    # Add styling with reduced padding
+    mermaid_lines.extend(
+        [
+            "    %% Styling",
+            "    classDef default fill:#f9f9f9,stroke:#333,stroke-width:2px,color:#000,max-width:none,text-overflow:clip,padding:0px;",
+            "    classDef source fill:#e1f5fe,stroke:#0277bd,stroke-width:2px,color:#000,max-width:none,text-overflow:clip,padding:0px;",
+            "    classDef reference fill:#e8e7ff,stroke:#6b69d6,stroke-width:2px,color:#000,max-width:none,text-overflow:clip,padding:0px;",
+        ]
+    )
+
+    # Collect all unique files and create nodes
+    unique_files = set()
+    for defined_file, referenced_file in dependencies.keys():
+        unique_files.add(defined_file)
+        unique_files.add(referenced_file)
+
+    # Create nodes for each unique file
+    node_names = {}
+    for idx, file in enumerate(unique_files):
+        node_name = f"n{idx}"
+        node_names[file] = node_name
+        display_name = get_display_name(file)
+        clean_name = display_name.replace('"', "&quot;")
+        mermaid_lines.append(f'    {node_name}["{clean_name}"]')
+
+    # Create reference nodes and connections
+    for idx, ((defined_file, referenced_file), symbols) in enumerate(
+        dependencies.items()
+    ):
+        from_node = node_names[defined_file]
+        to_node = node_names[referenced_file]
+        ref_node = f"ref{idx}"
+
+        # Clean and truncate symbols
+        cleaned_symbols = []
+        for symbol in sorted(symbols):
+            clean_symbol = str(symbol)
+            clean_symbol = clean_symbol.replace('"', "&quot;")
+            clean_symbol = clean_symbol.replace("<", "&lt;")
+            clean_symbol = clean_symbol.replace(">", "&gt;")
+            if len(clean_symbol) > 20:
+                clean_symbol = clean_symbol[:17] + "..."
+            cleaned_symbols.append(clean_symbol)
+
+        # Create symbol display with limited number of examples
+        symbols_display = "<br/>" + "<br/>".join(cleaned_symbols)
+        if len(cleaned_symbols) > 5:
+            symbols_display = (
+                "<br/>" + "<br/>".join(cleaned_symbols[:5]) + "<br/>..."
+            )
+
+        # Add reference node and connections
+        ref_node_def = (
+            f'    {ref_node}["{len(symbols)} refs{symbols_display}"]'
+        )
+        mermaid_lines.append(ref_node_def)
+        mermaid_lines.append(f"    {to_node} --> {ref_node} --> {from_node}")
+        mermaid_lines.append(f"    class {ref_node} reference")
+
+    mermaid_lines.extend(
+        [
+            f"    class {node_names[next(iter(dependencies))[0]]} source;",
+        ]
+    )
+
+    return "\n".join(mermaid_lines)
+
+
+def needs_clustering(
+    graph: SymbolGraph,
+    max_nodes: int = MAX_DIAGRAM_NODES,
+    max_edges: int = MAX_DIAGRAM_EDGES,
+) -> bool:
+    """Whether a call graph is too big to draw one box per symbol."""
+    return len(graph) > max_nodes or graph.edge_count > max_edges
+
+
+def hierarchy_to_mermaid(
+    graph: SymbolGraph,
+    symbols_changed_directly: Set[HierarchyItem],
+    max_nodes: int = MAX_DIAGRAM_NODES,
+    max_edges: int = MAX_DIAGRAM_EDGES,
+) -> str:
+    """
+    Convert a call graph to a Mermaid diagram string with subgraphs by file.
+    Uses the symbols' IDs in the graph as node identifiers. Nodes that were changed directly are white.
+    Graphs with more than `max_nodes` symbols or `max_edges` references are drawn by
+    `clustered_hierarchy_to_mermaid` instead, so the diagram stays small enough to render.
+
+    Args:
+        graph: SymbolGraph of the code symbols and the references between them
+        symbols_changed_directly: Set of HierarchyItem objects that were changed directly
+        max_nodes: Most symbols to draw individually
+        max_edges: Most references to draw individually
+
+    Returns:
+        str: Mermaid diagram representation of the hierarchy with file-based subgraphs
+    """
+    if needs_clustering(graph, max_nodes, max_edges):
+        return clustered_hierarchy_to_mermaid(
+            graph, symbols_changed_directly, max_nodes, max_edges
+        )
+
+    mermaid_lines = [
+        "%%{",
+        "  init: {",
+        "    'flowchart': {",
+        "      'rankSpacing': 100,",  # Increase vertical space between ranks
+        "      'nodeSpacing': 50,",  # Increase horizontal space between nodes
+        "      'padding': 20",  # Add padding around the entire diagram
+        "    }",
+        "  }",
+        "}%%",
+        "graph TD",
+    ]
+
+    # Group node IDs by file
+    nodes_by_file = {}
+    for node_id, node in enumerate(graph.items):
+        nodes_by_file.setdefault(node.defined_at.path, []).append(node_id)
+
+    # Create subgraphs for each file
+    for file_idx, (file_path, node_ids) in enumerate(nodes_by_file.items()):
+        # Create subgraph with unique ID
+        subgraph_id = f"subgraph_{file_idx}"
+        mermaid_lines.append(f"    subgraph {subgraph_id}[{file_path}]")
+
+        # Add nodes for this file
+        for node_id in node_ids:
+            node = graph.items[node_id]
+            # Escape quotes and special characters in names
+            escaped_name = node.name.replace('"', '\\"')
+            # Add kind as a suffix in italics
+            label = f'"{escaped_name}<br><i>{node.kind}</i>"'
+            mermaid_lines.append(f"        node{node_id}[{label}]")
+
+        # Close subgraph
+        mermaid_lines.append("    end")
+
+    # Add edges row by row from the adjacency arrays (outside subgraphs)
+    offsets, targets = graph.adjacency()
+    for from_id in range(len(graph)):
+        for to_id in targets[offsets[from_id] : offsets[from_id + 1]]:
+            mermaid_lines.append(f"    node{from_id} --> node{to_id}")
+
+    # Color the nodes changed directly white and the rest red
+    for node_id, node in enumerate(graph.items):
+        if node not in symbols_changed_directly:
+            mermaid_lines.append(f"    style node{node_id} fill:#ffcccc,color:#000")
+    for node_id, node in enumerate(graph.items):
+        if node in symbols_changed_directly:
+            mermaid_lines.append(f"    style node{node_id} fill:#ffffff,color:#000")
+
+    return "\n".join(mermaid_lines)
+
+
+def clustered_hierarchy_to_mermaid(
+    graph: SymbolGraph,
+    symbols_changed_directly: Set[HierarchyItem],
+    max_clusters: int = MAX_DIAGRAM_NODES,
+    max_edges: int = MAX_DIAGRAM_EDGES,
+) -> str:
+    """
+    Draw a call graph with one box per file, or per directory when there are too many files.
+
+    Each box counts the symbols in it and each arrow counts the references between two boxes.
+    Only the `max_edges` arrows carrying the most references are drawn, so the size of the diagram
+    doesn't depend on the size of the graph. Boxes holding a symbol that was changed directly are
+    white and the rest are red, like in `hierarchy_to_mermaid`.
+    """
+    clusters = cluster_paths([node.defined_at.path for node in graph.items], max_clusters)
+    cluster_ids = {
+        cluster: f"cluster{idx}"
+        for idx, cluster in enumerate(sorted(set(clusters.values())))
+    }
+    # The cluster of each node ID, so counting references only indexes into a list
+    node_clusters = [clusters[node.defined_at.path] for node in graph.items]
+    symbol_counts = Counter(node_clusters)
+    changed_clusters = {
+        node_clusters[node_id]
+        for node_id, node in enumerate(graph.items)
+        if node in symbols_changed_directly
+    }
+    offsets, targets = graph.adjacency()
+    reference_counts = Counter(
+        (node_clusters[from_id], node_clusters[to_id])
+        for from_id in range(len(graph))
+        for to_id in targets[offsets[from_id] : offsets[from_id + 1]]
+    )
+    arrows = [
+        (pair, count)
+        for pair, count in reference_counts.most_common()
+        if pair[0] != pair[1]
+    ]
+
+    mermaid_lines = ["graph TD"]
+    for cluster, cluster_id in cluster_ids.items():
+        escaped_name = cluster.replace('"', '\\"')
+        mermaid_lines.append(
+            f'    {cluster_id}["{escaped_name}<br><i>{symbol_counts[cluster]} symbols</i>"]'
+        )
+    for (from_cluster, to_cluster), count in arrows[:max_edges]:
+        mermaid_lines.append(
+            f"    {cluster_ids[from_cluster]} -->|{count}| {cluster_ids[to_cluster]}"
+        )
+    if len(arrows) > max_edges:
+        mermaid_lines.append(
+            f'    more_edges["{len(arrows) - max_edges} more connections not drawn"]'
+        )
+
+    for cluster, cluster_id in cluster_ids.items():
+        fill = "#ffffff" if cluster in changed_clusters else "#ffcccc"
+        mermaid_lines.append(f"    style {cluster_id} fill:{fill},color:#000")
+
+    return "\n".join(mermaid_lines)
+
+
+def hierarchy_to_adjacency(graph: SymbolGraph) -> List[Dict[str, str]]:
+    """
+    List every symbol in a call graph with the symbols the change flows on to from it, one row each.
+
+    This is the whole graph in a form that stays readable at any size, e.g. for `mo.ui.table`,
+    which pages through the rows and can download them as CSV or JSON.
+    """
+    items = graph.items
+    return [
+        {
+            "file": node.defined_at.path,
+            "line": node.defined_at.position.line + 1,
+            "symbol": node.name,
+            "kind": node.kind,
+            "affects": ", ".join(
+                sorted(
+                    f"{items[to_id].name} ({items[to_id].defined_at.path})"
+                    for to_id in graph.successors(node_id)
+                )
+            ),
+        }
+        for node_id, node in sorted(enumerate(items), key=lambda pair: pair[1].key)
+    ]
+
+
+class BlastRadius:
+    """
+    Find the symbols a change touches, and follow it through the code that references them.
+
+    `client` is an lsproxy client. If it has a `symbol_index(file_path)` method returning a `SymbolIndex`,
+    like the tutorial's cached client, that's used, otherwise the symbols of each file are fetched once and
+    indexed here. If it has a `call_graph` (a `ReverseCallGraph` from workspace_index.py), or one is
+    passed in, the references to symbols in it are looked up there instead of asking lsproxy.
+    HierarchyItems are made with `source_reader`, if there is one, so their source code can be read.
+    """
+
+    def __init__(
+        self,
+        client,
+        source_reader=None,
+        call_graph=None,
+        max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS,
+    ):
+        self.client = client
+        self.source_reader = source_reader
+        self.max_concurrent_requests = max_concurrent_requests
+        self._call_graph = call_graph
+        self._lock = threading.Lock()
+        # file_path -> SymbolIndex, for clients that don't index symbols themselves
+        self._indexes = {}
+        # The ReverseCallGraph items were made from, and key -> HierarchyItem for its symbols
+        self._call_graph_items = (None, {})
+
+    def _item(self, symbol) -> HierarchyItem:
+        return HierarchyItem(
+            name=symbol.name,
+            kind=symbol.kind,
+            defined_at=symbol.identifier_position,
+            range=symbol.range,
+            source_reader=self.source_reader,
+        )
+
+    def symbol_index(self, file_path: str) -> SymbolIndex:
+        """A `SymbolIndex` over the symbols defined in a file."""
+        if hasattr(self.client, "symbol_index"):
+            return self.client.symbol_index(file_path)
+        with self._lock:
+            index = self._indexes.get(file_path)
+        if index is None:
+            index = SymbolIndex(self.client.definitions_in_file(file_path))
+            with self._lock:
+                index = self._indexes.setdefault(file_path, index)
+        return index
+
+    @property
+    def call_graph(self):
+        return self._call_graph if self._call_graph is not None else getattr(self.client, "call_graph", None)
+
+    def get_symbols_containing_positions(self, target_positions: List[FilePosition]) -> Set[HierarchyItem]:
+        """The symbols containing any of `target_positions`, which are all in the same file."""
+        file_path = target_positions[0].path
+
+        # Get an index over the ranges of all the definitions in the file,
+        # and save the ones that contain some of our affected lines
+        return {self._item(symbol) for symbol in self.symbol_index(file_path).enclosing_many(target_positions)}
+
+    def get_symbols_overlapping_lines(self, file_path: str, line_ranges) -> Set[HierarchyItem]:
+        """
+        The symbols in `file_path` containing a changed line, given as (first line, last line) ranges
+        counted from 1, like git and `parse_diff` count them.
+        """
+        # lsproxy counts lines from 0
+        zero_based = [(first - 1, last - 1) for first, last in line_ranges]
+        return {self._item(symbol) for symbol in self.symbol_index(file_path).overlapping_lines(zero_based)}
+
+    def symbols_changed_in(
+        self, changed_lines: Dict[str, LineRanges], workspace_files: Optional[Set[str]] = None
+    ) -> Set[HierarchyItem]:
+        """
+        The symbols containing a line in `changed_lines`, from `parse_diff`.
+
+        Files lsproxy doesn't serve (`workspace_files`, by default all of them) are skipped.
+        """
+        if workspace_files is None:
+            workspace_files = set(self.client.list_files())
+        symbols = set()
+        for file_path, line_ranges in changed_lines.items():
+            if file_path in workspace_files:
+                symbols.update(self.get_symbols_overlapping_lines(file_path, line_ranges.ranges()))
+        return symbols
+
+    def _dependents(self, call_graph, symbol: HierarchyItem) -> Set[HierarchyItem]:
+        # Each symbol in the graph is made into a HierarchyItem once, so a search through it is mostly dict lookups
+        graph = getattr(call_graph, "graph", call_graph)
+        with self._lock:
+            if self._call_graph_items[0] is not graph:
+                self._call_graph_items = (graph, {})
+            items = self._call_graph_items[1]
+        dependents = set()
+        for key in call_graph.dependents(symbol.key):
+            item = items.get(key)
+            if item is None:
+                item = items.setdefault(key, self._item(call_graph.symbol(key)))
+            dependents.add(item)
+        return dependents
+
+    def find_related_symbols(self, symbol: HierarchyItem) -> Set[HierarchyItem]:
+        """
+        Find the symbols whose code references the given symbol.
+        """
+        # Once workspace_index.py has built the reverse call graph this is a local lookup
+        call_graph = self.call_graph
+        if call_graph is not None and symbol.key in call_graph:
+            return self._dependents(call_graph, symbol)
+
+        # Otherwise find all the references to the symbol
+        references = self.client.find_references(
+            GetReferencesRequest(
+                identifier_position=symbol.defined_at,
+                include_declaration=False,
+            )
+        ).references
+
+        # Group them by file
+        references_by_file = {}
+        for ref in references:
+            references_by_file.setdefault(ref.path, []).append(ref)
+
+        # And then find symbols that contain the references
+        return {
+            sym
+            for refs in references_by_file.values()
+            for sym in self.get_symbols_containing_positions(refs)
+        }
+
+    def stream_changes_through_codebase(
+        self,
+        symbols_changed_directly: Iterable[HierarchyItem],
+        limits: PropagationLimits = PropagationLimits(),
+        max_concurrent_requests: Optional[int] = None,
+        related_symbols_cache: Optional[Dict[HierarchyItem, Set[HierarchyItem]]] = None,
+    ) -> Iterator[PropagationUpdate]:
+        """
+        Compute the chain of code symbols that touch the code at the starting positions, yielding the
+        symbols and references as they're found.
+
+        We go level by level: the related symbols of everything found at one level are looked up
+        concurrently, and the ones we haven't seen before make up the next level.
+        A symbol is yielded once its level starts, and a reference once both of its ends have been
+        yielded, so everything yielded is part of the final graph. The last update comes when the
+        search is over, and its `truncated_by` names the `limits` that were hit, if any stopped it early.
+        Passing the same `related_symbols_cache` to later calls makes them incremental: only symbols
+        that no earlier call expanded are looked up, the rest of the graph is walked from the cache.
+        Use a RelatedSymbolsCache to have entries forgotten when the files they came from are edited.
+        """
+        # Symbols get an ID in the graph when their level starts, and references are stored as pairs of IDs
+        graph = SymbolGraph()
+        # References to symbols that might still be cut by max_nodes, held back until their level starts
+        pending_edges: List[Tuple[int, HierarchyItem]] = []
+        truncated_by = set()
+        if related_symbols_cache is None:
+            related_symbols_cache = {}
+        elif isinstance(related_symbols_cache, RelatedSymbolsCache):
+            related_symbols_cache.forget_if_stale()
+
+        # Stop sending requests once the time budget runs out, even if lsproxy is in the middle of a slow one
+        out_of_time = threading.Event()
+        timer = None
+        if limits.time_budget_seconds is not None:
+            timer = threading.Timer(limits.time_budget_seconds, out_of_time.set)
+            timer.daemon = True
+            timer.start()
+
+        # Initialize with symbols that contain the starting positions
+        frontier = set(symbols_changed_directly)
+        depth = 0
+
+        try:
+            while frontier:
+                if limits.max_nodes is not None and len(graph) + len(frontier) > limits.max_nodes:
+                    # Keep the symbols that come first in the codebase so the cut is the same on every run
+                    room = max(limits.max_nodes - len(graph), 0)
+                    frontier = set(sorted(frontier, key=lambda sym: sym.key)[:room])
+                    truncated_by.add("max_nodes")
+                for symbol in frontier:
+                    graph.add_node(symbol)
+                ready_edges = set()
+                for source, target in pending_edges:
+                    if target in frontier:
+                        graph.add_edge(source, graph.id_of(target))
+                        ready_edges.add((graph.items[source], target))
+                pending_edges.clear()
+                yield PropagationUpdate(frontier, ready_edges, sorted(truncated_by), graph)
+
+                if limits.max_depth is not None and depth >= limits.max_depth:
+                    truncated_by.add("max_depth")
+                    break
+                level = list(frontier)
+                frontier = set()
+
+                # Symbols expanded by an earlier call come from the cache, and the call graph answers for the
+                # ones it has without a thread each, so only the rest go to lsproxy
+                # One read per symbol, since searches sharing the cache may forget entries at any time
+                from_cache = [(symbol, related_symbols_cache.get(symbol)) for symbol in level]
+                cached = [(symbol, related_symbols) for symbol, related_symbols in from_cache if related_symbols is not None]
+                to_look_up = [symbol for symbol, related_symbols in from_cache if related_symbols is None]
+                call_graph = self.call_graph
+                in_call_graph = [symbol for symbol in to_look_up if call_graph is not None and symbol.key in call_graph]
+                if in_call_graph:
+                    to_look_up = [symbol for symbol in to_look_up if symbol.key not in call_graph]
+                from_call_graph = ((symbol, self._dependents(call_graph, symbol)) for symbol in in_call_graph)
+                looked_up = (
+                    (to_look_up[index], related_symbols)
+                    for index, related_symbols in fan_out(
+                        self.find_related_symbols,
+                        to_look_up,
+                        max_workers=max_concurrent_requests or self.max_concurrent_requests,
+                        cancel_event=out_of_time,
+                    )
+                )
+
+                expanded = 0
+                for symbol, related_symbols in itertools.chain(cached, from_call_graph, looked_up):
+                    expanded += 1
+                    related_symbols_cache[symbol] = related_symbols
+                    if limits.max_symbols_per_file is not None:
+                        related_by_file = {}
+                        for related_symbol in sorted(related_symbols, key=lambda sym: sym.key):
+                            related_by_file.setdefault(related_symbol.defined_at.path, []).append(related_symbol)
+                        if any(len(syms) > limits.max_symbols_per_file for syms in related_by_file.values()):
+                            truncated_by.add("max_symbols_per_file")
+                        related_symbols = [
+                            sym for syms in related_by_file.values() for sym in syms[: limits.max_symbols_per_file]
+                        ]
+
+                    symbol_id = graph.id_of(symbol)
+                    new_edges = set()
+                    for related_symbol in related_symbols:
+                        if related_symbol != symbol:
+                            related_id = graph.id_of(related_symbol)
+                            if related_id is not None:
+                                graph.add_edge(symbol_id, related_id)
+                                new_edges.add((symbol, related_symbol))
+                            else:
+                                pending_edges.append((symbol_id, related_symbol))
+                                # Keep processing the symbols we haven't already seen
+                                frontier.add(related_symbol)
+                    if new_edges:
+                        yield PropagationUpdate(set(), new_edges, sorted(truncated_by), graph)
+
+                if out_of_time.is_set():
+                    # The budget only cut the search short if it left symbols unexpanded or a level to go
+                    if frontier or expanded < len(level):
+                        truncated_by.add("time_budget_seconds")
+                    break
+                depth += 1
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        # Whatever is still pending points outside the result, so it's dropped
+        yield PropagationUpdate(set(), set(), sorted(truncated_by), graph)
+
+    def propagate_changes_through_codebase(
+        self,
+        symbols_changed_directly: Iterable[HierarchyItem],
+        limits: PropagationLimits = PropagationLimits(),
+        max_concurrent_requests: Optional[int] = None,
+        related_symbols_cache: Optional[Dict[HierarchyItem, Set[HierarchyItem]]] = None,
+    ) -> PropagationResult:
+        """
+        Run `stream_changes_through_codebase` to the end and return the whole graph at once.
+        """
+        for update in self.stream_changes_through_codebase(
+            symbols_changed_directly,
+            limits=limits,
+            max_concurrent_requests=max_concurrent_requests,
+            related_symbols_cache=related_symbols_cache,
+        ):
+            pass
+        return PropagationResult(update.graph, update.truncated_by)
+
+    def analyze_commit_range(
+        self,
+        repo: str,
+        commit_range: str,
+        limits: PropagationLimits = PropagationLimits(),
+        workspace_files: Optional[Set[str]] = None,
+        max_concurrent_requests: Optional[int] = None,
+        related_symbols_cache: Optional[Dict[HierarchyItem, Set[HierarchyItem]]] = None,
+    ) -> "RangeAnalysis":
+        """
+        The lines, symbols and propagation of the change in one commit range of the checkout at `repo`.
+
+        Raises ValueError if the range can't be analyzed against the working tree, see `resolve_commit_range`.
+        """
+        return self._analyze_resolved(
+            repo,
+            commit_range,
+            *resolve_commit_range(repo, commit_range),
+            limits=limits,
+            workspace_files=workspace_files,
+            max_concurrent_requests=max_concurrent_requests,
+            related_symbols_cache=related_symbols_cache,
+        )
+
+    def _analyze_resolved(
+        self,
+        repo: str,
+        commit_range: str,
+        base: str,
+        head: Optional[str],
+        limits: PropagationLimits,
+        workspace_files: Optional[Set[str]],
+        max_concurrent_requests: Optional[int],
+        related_symbols_cache: Optional[Dict[HierarchyItem, Set[HierarchyItem]]],
+    ) -> "RangeAnalysis":
+        changed_lines = parse_diff(git_diff_lines(repo, base, head))
+        changed_directly = self.symbols_changed_in(changed_lines, workspace_files)
+        propagation = self.propagate_changes_through_codebase(
+            changed_directly,
+            limits=limits,
+            max_concurrent_requests=max_concurrent_requests,
+            related_symbols_cache=related_symbols_cache,
+        )
+        return RangeAnalysis(commit_range, base, head, changed_lines, changed_directly, propagation)
+
+    def analyze_commit_ranges(
+        self,
+        repo: str,
+        commit_ranges: List[str],
+        limits: PropagationLimits = PropagationLimits(),
+        concurrent_ranges: int = BATCH_CONCURRENT_RANGES,
+        related_symbols_cache: Optional[Dict[HierarchyItem, Set[HierarchyItem]]] = None,
+    ) -> Iterator[Tuple[int, "RangeAnalysis"]]:
+        """
+        Analyze every range in `commit_ranges`, `concurrent_ranges` at a time, yielding
+        (index into commit_ranges, RangeAnalysis) as each one finishes.
+
+        The ranges share `related_symbols_cache` and split `max_concurrent_requests` between them, so a
+        symbol several of them reach is only looked up once and lsproxy sees the same load as for one range.
+        Every range is resolved before any is analyzed, so one that can't be raises ValueError straight away.
+        """
+        resolved = [resolve_commit_range(repo, commit_range) for commit_range in commit_ranges]
+        workspace_files = set(self.client.list_files())
+        if related_symbols_cache is None:
+            related_symbols_cache = {}
+        max_concurrent_requests = max(self.max_concurrent_requests // concurrent_ranges, 1)
+        return fan_out(
+            lambda index: self._analyze_resolved(
+                repo,
+                commit_ranges[index],
+                *resolved[index],
+                limits=limits,
+                workspace_files=workspace_files,
+                max_concurrent_requests=max_concurrent_requests,
+                related_symbols_cache=related_symbols_cache,
+            ),
+            range(len(commit_ranges)),
+            max_workers=concurrent_ranges,
+        )
+
+    def referenced_symbols_in_file(self, file_path: str) -> Dict[Tuple[str, str], Set[str]]:
+        """
+        Which symbols defined in `file_path` each other file references, keyed by (file_path, referencing file),
+        the input `generate_reference_diagram` draws.
+        """
+        symbols = self.client.definitions_in_file(file_path)
+
+        def find_references(symbol):
+            return self.client.find_references(
+                GetReferencesRequest(identifier_position=symbol.identifier_position)
+            ).references
+
+        referenced_symbols = {}
+        for index, references in sorted(
+            fan_out(find_references, symbols, max_workers=self.max_concurrent_requests)
+        ):
+            for ref in references:
+                if ref.path != file_path:
+                    referenced_symbols.setdefault((file_path, ref.path), set()).add(symbols[index].name)
+        return referenced_symbols
+
+
+class RangeAnalysis(NamedTuple):
+    commit_range: str
+    # The commits diffed, from `resolve_commit_range`, head being None for the working tree
+    base: str
+    head: Optional[str]
+    changed_lines: Dict[str, LineRanges]
+    changed_directly: Set[HierarchyItem]
+    propagation: PropagationResult
+
+
+def blast_radius_report(analysis: RangeAnalysis) -> dict:
+    """A JSON-friendly report of one range's analysis, symbols are referred to by their index in `symbols`."""
+    propagation = analysis.propagation
+    symbols = sorted(propagation.graph.items, key=lambda symbol: symbol.key)
+    ids = {symbol: index for index, symbol in enumerate(symbols)}
+    return {
+        "range": analysis.commit_range,
+        "base": analysis.base,
+        "head": analysis.head,
+        "changed_lines": {
+            file: [list(line_range) for line_range in line_ranges.ranges()]
+            for file, line_ranges in sorted(analysis.changed_lines.items())
+        },
+        "symbols": [
+            {
+                "name": symbol.name,
+                "kind": symbol.kind,
+                "path": symbol.defined_at.path,
+                "line": symbol.defined_at.position.line,
+                "character": symbol.defined_at.position.character,
+                "changed_directly": symbol in analysis.changed_directly,
+            }
+            for symbol in symbols
+        ],
+        # [referenced symbol, symbol referencing it]
+        "references": sorted([ids[source], ids[target]] for source, target in propagation.graph.edges()),
+        "files_affected": sorted({symbol.defined_at.path for symbol in symbols}),
+        "truncated_by": propagation.truncated_by,
+    }
+
+
+def blast_radius_mermaid(analysis: RangeAnalysis) -> str:
+    """One range's call graph as a Mermaid diagram."""
+    propagation = analysis.propagation
+    return hierarchy_to_mermaid(propagation.graph, analysis.changed_directly)
+
+
+def write_blast_radius_report(report_dir: str, analysis: RangeAnalysis, report: Optional[dict] = None) -> str:
+    """Write a range's report as JSON, and its call graph as Mermaid, named after the range. Returns the JSON's path."""
+    os.makedirs(report_dir, exist_ok=True)
+    base_name = os.path.join(report_dir, re.sub(r"[^\w.-]+", "_", analysis.commit_range))
+    with open(f"{base_name}.json", "w") as f:
+        json.dump(report if report is not None else blast_radius_report(analysis), f, indent=2)
+    with open(f"{base_name}.mmd", "w") as f:
+        f.write(blast_radius_mermaid(analysis))
+    return f"{base_name}.json"
+
+
+def _make_analysis(args) -> BlastRadius:
+    # Imported here, so importing this module doesn't set up an HTTP client
+    from lsproxy_transport import PooledLsproxy
+    from workspace_index import CurrentCallGraph, ReverseCallGraph, Workspace, call_graph_path, default_cache_dir
+
+    client = PooledLsproxy(base_url=args.base_url, pool_size=args.workers)
+    call_graph = None
+    workspace = Workspace(args.workspace) if args.workspace else None
+    if workspace is not None and workspace.version is not None:
+        path = call_graph_path(default_cache_dir(), workspace.version)
+        if os.path.exists(path):
+            # Symbols in files edited since the graph was built are looked up in lsproxy instead
+            call_graph = CurrentCallGraph(ReverseCallGraph.load(path), workspace)
+    return BlastRadius(client, call_graph=call_graph, max_concurrent_requests=args.workers)
+
+
+def changes(args) -> int:
+    analysis = _make_analysis(args)
+    limits = PropagationLimits(
+        max_depth=args.max_depth,
+        max_nodes=args.max_nodes,
+        time_budget_seconds=args.time_budget,
+        max_symbols_per_file=args.max_symbols_per_file,
+    )
+    results = [None] * len(args.ranges)
+    try:
+        analyses = analysis.analyze_commit_ranges(args.workspace, args.ranges, limits=limits)
+    except ValueError as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 2
+    for index, range_analysis in analyses:
+        if args.output_dir:
+            path = write_blast_radius_report(args.output_dir, range_analysis)
+            print(path, file=sys.stderr)
+        else:
+            results[index] = range_analysis
+    if not args.output_dir:
+        for range_analysis in results:
+            if args.format == "mermaid":
+                print(f"%% {range_analysis.commit_range}")
+                print(blast_radius_mermaid(range_analysis))
+            else:
+                # One line per range, so several ranges can be read back as JSON lines
+                print(json.dumps(blast_radius_report(range_analysis)))
+    return 0
+
+
+def references(args) -> int:
+    referenced_symbols = _make_analysis(args).referenced_symbols_in_file(args.file)
+    if args.format == "mermaid":
+        print(generate_reference_diagram(referenced_symbols))
+    else:
+        report = {
+            "file": args.file,
+            "referenced_by": {
+                referencing_file: sorted(symbols)
+                for (_, referencing_file), symbols in sorted(referenced_symbols.items())
+            },
+        }
+        print(json.dumps(report))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-url", default=os.environ.get("BASE_URL", "http://localhost:4444/v1"))
+    parser.add_argument(
+        "--workspace",
+        default=os.environ.get("CHECKOUT_LOCATION", "."),
+        help="The git checkout lsproxy is serving",
+    )
+    parser.add_argument("--workers", type=int, default=MAX_CONCURRENT_REQUESTS, help="Concurrent requests")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    changes_parser = subparsers.add_parser("changes", help="Follow the changes in commit ranges through the code")
+    changes_parser.add_argument(
+        "ranges",
+        nargs="+",
+        help="base..head, base...head for the change since head branched off base, a single commit for its "
+        "change from its first parent, or base.. for the working tree. Ranges whose files have changed "
+        "since head are rejected, lsproxy only knows the working tree",
+    )
+    changes_parser.add_argument(
+        "--format", choices=["json", "mermaid"], help="What to print for each range (default: json)"
+    )
+    changes_parser.add_argument(
+        "--output-dir", help="Write a JSON and a Mermaid report per range here, instead of printing one"
+    )
+    changes_parser.add_argument("--max-depth", type=int, help="Reference hops to follow from the changed symbols")
+    changes_parser.add_argument("--max-nodes", type=int, default=500, help="Symbols to stop at")
+    changes_parser.add_argument("--time-budget", type=float, default=300, help="Seconds to stop after")
+    changes_parser.add_argument(
+        "--max-symbols-per-file", type=int, help="Symbols followed into any one file from a single symbol"
+    )
+
+    references_parser = subparsers.add_parser("references", help="Find the files referencing a file's symbols")
+    references_parser.add_argument("file", help="Path of the file in the workspace")
+    references_parser.add_argument("--format", choices=["json", "mermaid"], default="json")
+
+    args = parser.parse_args()
+    if args.command == "changes":
+        if args.format and args.output_dir:
+            parser.error("--output-dir writes both formats, so --format can't be used with it")
+        args.format = args.format or "json"
+        return changes(args)
+    return references(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""
+Find the lines a git diff changes, without holding the diff in memory.
+
+`git_diff_lines` streams the output of `git diff` with rename detection on, and `parse_diff` walks it
+one line at a time, keeping the changed lines of each file as sorted, merged `LineRanges`. A large diff
+costs memory in proportion to the number of changed regions, not the number of changed lines.
+
+Line numbers are those of the new version of each file, which is what lsproxy serves. They count from 1,
+like git's, while lsproxy's positions count from 0, so subtract 1 before comparing them with a symbol's
+range (`BlastRadius.get_symbols_overlapping_lines` does):
+
+- Added lines are where they are in the new file.
+- Removed lines no longer exist, so a run of them is placed on the line that now follows it, which is
+  where the code around the removal changed. At the end of a hunk, where that line may be past the end
+  of the file, it's placed on the line before it too.
+- A renamed file is recorded under its new path, and only the lines that changed across the rename count.
+- A deleted file is recorded under its old path, with its old line numbers.
+"""
+
+import io
+import re
+import subprocess
+from array import array
+from bisect import bisect_right
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class LineRanges:
+    """
+    A set of line numbers, stored as sorted, disjoint, inclusive ranges.
+
+    Lines are cheapest to `add` in increasing order, which is how a diff lists them.
+    """
+
+    __slots__ = ("_bounds",)
+
+    def __init__(self, ranges: Iterable[Tuple[int, int]] = ()):
+        # start, end, start, end, ...
+        self._bounds = array("l")
+        for start, end in ranges:
+            self.add(start, end)
+
+    def add(self, start: int, end: Optional[int] = None):
+        """Add the lines from `start` to `end` inclusive, or just `start`."""
+        end = start if end is None else end
+        bounds = self._bounds
+        if not bounds or start > bounds[-1] + 1:
+            bounds.append(start)
+            bounds.append(end)
+        elif start >= bounds[-2]:
+            # Overlaps or touches the last range
+            bounds[-1] = max(bounds[-1], end)
+        else:
+            merged = array("l")
+            for range_start, range_end in sorted([*self.ranges(), (start, end)]):
+                if merged and range_start <= merged[-1] + 1:
+                    merged[-1] = max(merged[-1], range_end)
+                else:
+                    merged.append(range_start)
+                    merged.append(range_end)
+            self._bounds = merged
+
+    def ranges(self) -> Iterator[Tuple[int, int]]:
+        """The (first line, last line) of each range, in order."""
+        return zip(self._bounds[0::2], self._bounds[1::2])
+
+    def __iter__(self) -> Iterator[int]:
+        for start, end in self.ranges():
+            yield from range(start, end + 1)
+
+    def __len__(self):
+        return sum(end - start + 1 for start, end in self.ranges())
+
+    def __contains__(self, line: int):
+        # Odd positions fall inside a range, even ones only match if the line is that range's end
+        position = bisect_right(self._bounds, line)
+        return position % 2 == 1 or (position > 0 and self._bounds[position - 1] == line)
+
+    def __eq__(self, other):
+        return isinstance(other, LineRanges) and self._bounds == other._bounds
+
+    def __repr__(self):
+        return f"LineRanges({list(self.ranges())})"
+
+
+def _diff_path(header: str, prefix: str) -> Optional[str]:
+    # The path in a "--- a/path" or "+++ b/path" line, or None for /dev/null
+    path = header[4:].rstrip("\n").rstrip("\r").rstrip("\t")
+    if path.startswith('"'):
+        # git C-quotes paths with unusual characters, escaping the bytes of their UTF-8 encoding
+        path = path[1:-1].encode("latin-1").decode("unicode_escape").encode("latin-1").decode("utf-8")
+    if path == "/dev/null":
+        return None
+    return path[len(prefix) :] if path.startswith(prefix) else path
+
+
+def _add_removal_at_hunk_end(ranges: LineRanges, next_line: int):
+    ranges.add(max(next_line - 1, 1), next_line)
+
+
+def parse_diff(lines: Iterable[str]) -> Dict[str, LineRanges]:
+    """
+    The lines each file in a unified diff changes, reading the diff one line at a time.
+
+    `lines` can be any iterable of lines, e.g. `git_diff_lines(...)`, an open file, or `text.splitlines()`.
+    """
+    changed_lines: Dict[str, LineRanges] = {}
+    source_path = target_path = None
+    ranges = None
+    source_line = target_line = source_left = target_left = 0
+    # Removed lines waiting for the next line of the new file, to be placed on it
+    removal_pending = False
+
+    for line in lines:
+        if source_left > 0 or target_left > 0:
+            tag = line[:1]
+            if tag == "\\":
+                # "\ No newline at end of file"
+                continue
+            if tag in ("-", "+", " ", "\n", "\r", ""):
+                if tag == "-":
+                    if target_path is None:
+                        ranges.add(source_line)
+                    else:
+                        removal_pending = True
+                    source_line += 1
+                    source_left -= 1
+                elif tag == "+":
+                    ranges.add(target_line)
+                    removal_pending = False
+                    target_line += 1
+                    target_left -= 1
+                else:
+                    # Context, including lines whose trailing space was stripped
+                    if removal_pending:
+                        ranges.add(target_line)
+                        removal_pending = False
+                    source_line += 1
+                    target_line += 1
+                    source_left -= 1
+                    target_left -= 1
+                if source_left <= 0 and target_left <= 0 and removal_pending:
+                    _add_removal_at_hunk_end(ranges, target_line)
+                    removal_pending = False
+                continue
+            # A hunk shorter than its header said, read the line as a header instead
+            source_left = target_left = 0
+            if removal_pending:
+                _add_removal_at_hunk_end(ranges, target_line)
+                removal_pending = False
+
+        if line.startswith("diff --git "):
+            source_path = target_path = None
+            ranges = None
+        elif line.startswith("--- "):
+            source_path = _diff_path(line, "a/")
+        elif line.startswith("+++ "):
+            target_path = _diff_path(line, "b/")
+            path = target_path if target_path is not None else source_path
+            ranges = changed_lines.setdefault(path, LineRanges()) if path is not None else None
+        elif line.startswith("@@ ") and ranges is not None:
+            match = _HUNK_HEADER.match(line)
+            if match:
+                source_start, source_count, target_start, target_count = match.groups()
+                source_left = 1 if source_count is None else int(source_count)
+                target_left = 1 if target_count is None else int(target_count)
+                # An empty side's start is the line before the hunk, rather than its first line
+                source_line = int(source_start) + (source_left == 0)
+                target_line = int(target_start) + (target_left == 0)
+
+    return {path: ranges for path, ranges in changed_lines.items() if ranges}
+
+
+def git_diff_command(base: str, head: Optional[str] = None):
+    """The `git diff` command `git_diff_lines` runs, with the options `parse_diff` expects."""
+    return [
+        "git",
+        "diff",
+        "--no-color",
+        "--no-ext-diff",
+        "--find-renames",
+        "--src-prefix=a/",
+        "--dst-prefix=b/",
+        base,
+    ] + ([head] if head else [])
+
+
+def git_diff_lines(repo: str, base: str, head: Optional[str] = None) -> Iterator[str]:
+    """
+    Stream the lines of `git diff base [head]` in the checkout at `repo`, as git writes them.
+
+    Without `head` the diff is against the working tree. Raises CalledProcessError if git fails.
+    """
+    process = subprocess.Popen(git_diff_command(base, head), cwd=repo, stdout=subprocess.PIPE)
+    finished = False
+    try:
+        yield from io.TextIOWrapper(process.stdout, encoding="utf-8", errors="replace")
+        finished = True
+    finally:
+        process.stdout.close()
+        # If the caller stopped early git may have died writing to the closed pipe, that's fine
+        returncode = process.wait()
+        if finished and returncode:
+            raise subprocess.CalledProcessError(returncode, process.args)
+
+
+def _git(repo: str, *args: str, input: Optional[bytes] = None) -> str:
+    return subprocess.run(
+        ["git", *args], cwd=repo, input=input, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+    ).stdout.decode("utf-8")
+
+
+def _commit(repo: str, revision: str, commit_range: str) -> str:
+    try:
+        return _git(repo, "rev-parse", "--verify", "--quiet", f"{revision}^{{commit}}").strip()
+    except subprocess.CalledProcessError:
+        raise ValueError(f"{commit_range}: {revision!r} isn't a commit") from None
+
+
+def resolve_commit_range(repo: str, commit_range: str) -> Tuple[str, Optional[str]]:
+    """
+    The (base, head) commits to diff for a commit range in the checkout at `repo`, head being None for
+    the working tree.
+
+    - `base..head` is the change from `base` to `head`, and `base..` from `base` to the working tree,
+      like `git diff base`.
+    - `base...head` is the change on `head` since it branched off `base`, like `git diff base...head`.
+    - A single commit is its change from its first parent, or everything in it for a root commit.
+
+    lsproxy only serves the working tree, so a diff's lines only match its symbols if `head` has the same
+    content there. Raises ValueError if any file the range changes has changed since `head`, or if the
+    range doesn't name commits.
+    """
+    if "..." in commit_range:
+        base, head = commit_range.split("...", 1)
+        head = _commit(repo, head or "HEAD", commit_range)
+        try:
+            base = _git(repo, "merge-base", _commit(repo, base or "HEAD", commit_range), head).strip()
+        except subprocess.CalledProcessError:
+            raise ValueError(f"{commit_range}: the commits have no common ancestor") from None
+    elif ".." in commit_range:
+        base, head = commit_range.split("..", 1)
+        base = _commit(repo, base or "HEAD", commit_range)
+        head = _commit(repo, head, commit_range) if head else None
+    else:
+        head = _commit(repo, commit_range, commit_range)
+        try:
+            base = _commit(repo, f"{head}^", commit_range)
+        except ValueError:
+            # A root commit adds everything in it, so diff it against the empty tree
+            base = _git(repo, "hash-object", "-t", "tree", "--stdin", input=b"").strip()
+
+    if head is not None:
+        changed = [path for path in _git(repo, "diff", "--name-only", "-z", base, head).split("\0") if path]
+        if changed:
+            edited_since = [
+                path for path in _git(repo, "diff", "--name-only", "-z", head, "--", *changed).split("\0") if path
+            ]
+            if edited_since:
+                raise ValueError(
+                    f"{commit_range}: {len(edited_since)} of the files it changes are different in the working "
+                    f"tree, e.g. {edited_since[0]}, and lsproxy only knows the working tree. "
+                    f"Check out {head[:12]} or use a range ending at the working tree (base..)"
+                )
+    return base, head
@@ -0,0 +1,406 @@
+"""
+The caches the tutorial puts in front of lsproxy (its Appendix E), outermost first:
+
+- `CachedDefinitionsClient` keeps each file's symbols in memory until the file changes
+- `SingleFlightClient` sends identical requests made at the same time only once
+- `IndexedClient` answers from the index `workspace_index.py` builds in the background
+- `DiskCachedClient` keeps responses in SQLite across restarts, keyed by the state of the code
+
+`wrap_client` stacks them on a raw client the way the tutorial does, so scripts like `benchmark.py`
+run through the same layers.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Optional
+
+from lsproxy import ReferencesResponse, Symbol
+from lsproxy.models import ReadSourceCodeResponse
+
+from blast_radius import SymbolIndex
+from lsproxy_metrics import Metrics, MeteredClient
+from lsproxy_recording import RecordingClient
+from workspace_index import (
+    CurrentCallGraph,
+    ReverseCallGraph,
+    Workspace,
+    WorkspaceIndex,
+    call_graph_path,
+    default_cache_dir,
+    index_path,
+    load_in_background,
+)
+
+
+class CachedDefinitionsClient:
+    """
+    Wrap an lsproxy client so the symbols in each file are fetched at most once.
+
+    `definitions_in_file` results are kept in an LRU keyed by file path, every other call goes straight
+    to the wrapped client. If `workspace_root` points at the checkout lsproxy is serving, an entry is
+    dropped as soon as its file is modified; otherwise call `invalidate` when the workspace changes.
+    `symbol_index` returns a `SymbolIndex` over the same cached symbols.
+    """
+
+    def __init__(self, client, max_files: int = 1024, workspace_root: Optional[str] = None):
+        self._client = client
+        self._max_files = max_files
+        self._workspace_root = workspace_root
+        self._lock = threading.Lock()
+        # file_path -> (modification time when fetched, symbols)
+        self._definitions = OrderedDict()
+        # file_path -> SymbolIndex, built on first use and dropped with the definitions
+        self._indexes = {}
+
+    def _modified_time(self, file_path):
+        if self._workspace_root is None:
+            return None
+        try:
+            return os.stat(os.path.join(self._workspace_root, file_path)).st_mtime_ns
+        except OSError:
+            return None
+
+    def definitions_in_file(self, file_path):
+        modified_time = self._modified_time(file_path)
+        with self._lock:
+            cached = self._definitions.get(file_path)
+            if cached is not None and cached[0] == modified_time:
+                self._definitions.move_to_end(file_path)
+                return cached[1]
+
+        symbols = self._client.definitions_in_file(file_path)
+        with self._lock:
+            self._definitions[file_path] = (modified_time, symbols)
+            self._definitions.move_to_end(file_path)
+            self._indexes.pop(file_path, None)
+            while len(self._definitions) > self._max_files:
+                evicted_path, _ = self._definitions.popitem(last=False)
+                self._indexes.pop(evicted_path, None)
+        return symbols
+
+    def symbol_index(self, file_path):
+        """Get a `SymbolIndex` over the symbols defined in a file."""
+        symbols = self.definitions_in_file(file_path)
+        with self._lock:
+            index = self._indexes.get(file_path)
+        if index is None or index.symbols is not symbols:
+            index = SymbolIndex(symbols)
+            with self._lock:
+                if file_path in self._definitions:
+                    self._indexes[file_path] = index
+        return index
+
+    def invalidate(self, file_paths=None):
+        """Forget the cached symbols for `file_paths`, or for every file if none are given."""
+        with self._lock:
+            if file_paths is None:
+                self._definitions.clear()
+                self._indexes.clear()
+                return
+            for file_path in file_paths:
+                self._definitions.pop(file_path, None)
+                self._indexes.pop(file_path, None)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class DiskCachedClient:
+    """
+    Wrap an lsproxy client so its responses are kept in a SQLite file across notebook restarts.
+
+    Entries are keyed by the request type and parameters, and by the state of the code the answer
+    depends on, taken from `workspace` (a `workspace_index.Workspace`): the symbols and source code of
+    a file by that file's modification time and size, references and the file list by the version of
+    the whole workspace as well. An edited file gets fresh answers on the next call. They're stored as
+    compressed JSON, and once the file grows past `max_bytes` the least recently used entries are
+    dropped. Calls this doesn't know about go straight to the wrapped client.
+    """
+
+    def __init__(self, client, path: str, workspace: Workspace, max_bytes: int = 512 * 1024 * 1024):
+        self._client = client
+        self._workspace = workspace
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                version TEXT, kind TEXT, params TEXT, response BLOB, size INTEGER, last_used REAL,
+                PRIMARY KEY (version, kind, params)
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _cached(self, version, kind, params, fetch, encode, decode):
+        # Answers about a file that doesn't exist (or a workspace that isn't a checkout any more) aren't kept
+        if version is None:
+            return fetch()
+        key = (version, kind, params)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response FROM responses WHERE version = ? AND kind = ? AND params = ?", key
+            ).fetchone()
+            if row is not None:
+                self._db.execute(
+                    "UPDATE responses SET last_used = ? WHERE version = ? AND kind = ? AND params = ?",
+                    (time.time(), *key),
+                )
+        if row is not None:
+            return decode(zlib.decompress(row[0]).decode("utf-8"))
+
+        response = fetch()
+        blob = zlib.compress(encode(response).encode("utf-8"))
+        with self._lock:
+            replaced = self._db.execute(
+                "SELECT size FROM responses WHERE version = ? AND kind = ? AND params = ?", key
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, blob, len(blob), time.time()),
+            )
+            self._size += len(blob) - (replaced[0] if replaced else 0)
+            if self._size > self._max_bytes:
+                self._evict()
+        return response
+
+    def _evict(self):
+        # Drop the least recently used entries until we're comfortably under the limit
+        target = self._max_bytes * 0.9
+        for rowid, size in self._db.execute(
+            "SELECT rowid, size FROM responses ORDER BY last_used"
+        ).fetchall():
+            if self._size <= target:
+                break
+            self._db.execute("DELETE FROM responses WHERE rowid = ?", (rowid,))
+            self._size -= size
+
+    def definitions_in_file(self, file_path):
+        return self._cached(
+            self._workspace.file_version(file_path),
+            "definitions_in_file",
+            file_path,
+            lambda: self._client.definitions_in_file(file_path),
+            lambda symbols: json.dumps([symbol.model_dump() for symbol in symbols]),
+            lambda text: [Symbol.model_validate(symbol) for symbol in json.loads(text)],
+        )
+
+    def find_references(self, request):
+        # References can be anywhere, so they depend on the whole workspace, and on the symbol's own file
+        # in between the checks of the workspace's version
+        file_version = self._workspace.file_version(request.identifier_position.path)
+        workspace_version = self._workspace.version
+        return self._cached(
+            f"{workspace_version}/{file_version}" if file_version and workspace_version else None,
+            "find_references",
+            request.model_dump_json(),
+            lambda: self._client.find_references(request),
+            lambda response: response.model_dump_json(),
+            ReferencesResponse.model_validate_json,
+        )
+
+    def read_source_code(self, request):
+        return self._cached(
+            self._workspace.file_version(request.path),
+            "read_source_code",
+            request.model_dump_json(),
+            lambda: self._client.read_source_code(request),
+            lambda response: response.model_dump_json(),
+            ReadSourceCodeResponse.model_validate_json,
+        )
+
+    def list_files(self):
+        return self._cached(
+            self._workspace.version, "list_files", "", self._client.list_files, json.dumps, json.loads
+        )
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class IndexedClient:
+    """
+    Wrap an lsproxy client so lookups are answered from the index built by `workspace_index.py`.
+
+    The indexer runs in the background after lsproxy starts, and writes an index for each version of
+    the `workspace` into `cache_dir`. The one for the current version is loaded on a background thread
+    once it appears, so no request waits on it; until then, and for anything the index can't answer,
+    calls go to the wrapped client. Files edited since they were indexed are never answered from it.
+    The reverse call graph the indexer writes after the index is available as `call_graph`.
+    """
+
+    def __init__(self, client, workspace: Workspace, cache_dir: str):
+        self._client = client
+        self._workspace = workspace
+        self._cache_dir = cache_dir
+        # Start loading now, so they're likely ready by the first lookup
+        self._start_loading()
+
+    def _start_loading(self):
+        self._load(index_path, WorkspaceIndex.load)
+        self._load(call_graph_path, ReverseCallGraph.load)
+
+    def _load(self, path_for, load):
+        version = self._workspace.version
+        if version is None:
+            return None
+        return load_in_background(path_for(self._cache_dir, version), load)
+
+    @property
+    def index(self):
+        """The `WorkspaceIndex` of the current version, or None if it isn't built or loaded yet."""
+        return self._load(index_path, WorkspaceIndex.load)
+
+    @property
+    def call_graph(self):
+        """The `CurrentCallGraph` of the current version, or None if it isn't built or loaded yet."""
+        call_graph = self._load(call_graph_path, ReverseCallGraph.load)
+        return CurrentCallGraph(call_graph, self._workspace) if call_graph is not None else None
+
+    def definitions_in_file(self, file_path):
+        index = self.index
+        if (
+            index is not None
+            and file_path in index.symbols_by_file
+            and index.is_current(file_path, self._workspace)
+        ):
+            return index.symbols_by_file[file_path]
+        return self._client.definitions_in_file(file_path)
+
+    def find_references(self, request):
+        index = self.index
+        # The index only has the plain list of references, without the declaration or any context
+        plain_request = not (
+            request.include_declaration
+            or request.include_code_context_lines
+            or request.include_raw_response
+        )
+        if (
+            index is not None
+            and plain_request
+            and index.is_current(request.identifier_position.path, self._workspace)
+        ):
+            references = index.references_to(request.identifier_position)
+            if references is not None:
+                return ReferencesResponse(references=references)
+        return self._client.find_references(request)
+
+    def list_files(self):
+        index = self.index
+        if index is not None:
+            return index.files
+        return self._client.list_files()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class SingleFlightClient:
+    """
+    Wrap an lsproxy client so identical requests made at the same time share one upstream call.
+
+    The first caller sends the request, and anyone asking for the same thing before it comes back
+    waits for that result (or error) instead of sending their own. Nothing is kept afterwards,
+    that's what the caches are for.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def _shared(self, key, call):
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            result = call()
+            future.set_result(result)
+            return result
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def definitions_in_file(self, file_path):
+        return self._shared(
+            ("definitions_in_file", file_path),
+            lambda: self._client.definitions_in_file(file_path),
+        )
+
+    def find_references(self, request):
+        return self._shared(
+            ("find_references", request.model_dump_json()),
+            lambda: self._client.find_references(request),
+        )
+
+    def read_source_code(self, request):
+        return self._shared(
+            ("read_source_code", request.model_dump_json()),
+            lambda: self._client.read_source_code(request),
+        )
+
+    def list_files(self):
+        return self._shared(("list_files",), self._client.list_files)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def wrap_client(
+    client,
+    workspace: Optional[Workspace] = None,
+    metrics: Optional[Metrics] = None,
+    cache_dir: Optional[str] = None,
+):
+    """
+    Put the caches from this module in front of a raw lsproxy client.
+
+    Responses are only cached on disk, and the workspace index only used, when `workspace` is the
+    `workspace_index.Workspace` lsproxy is serving, since that's how we know which version of the code
+    they belong to. They're kept in `cache_dir`, by default `workspace_index.default_cache_dir()`.
+    Setting LSPROXY_RECORD to a file records every response lsproxy sends into it, to replay later with
+    `python lsproxy_recording.py serve`. The caches on disk are skipped then, so every request the
+    tutorial makes reaches lsproxy and gets recorded.
+    With `metrics`, every layer counts and times the calls that reach it (see the tutorial's Appendix G).
+    """
+
+    def metered(client, layer):
+        return MeteredClient(client, metrics, layer) if metrics is not None else client
+
+    if metrics is not None:
+        # The calls that miss every cache, straight from the HTTP client if it can tell us their sizes
+        if hasattr(client, "hooks"):
+            client.hooks.append(metrics.observe_http)
+        else:
+            client = metered(client, "lsproxy")
+    record_path = os.environ.get("LSPROXY_RECORD")
+    if record_path:
+        client = RecordingClient(client, path=record_path)
+        workspace = None
+    version = workspace.version if workspace is not None else None
+    if version is not None:
+        cache_dir = cache_dir or default_cache_dir()
+        client = DiskCachedClient(client, os.path.join(cache_dir, "responses.sqlite"), workspace)
+        client = metered(client, "disk_cache")
+        client = IndexedClient(client, workspace, cache_dir)
+        client = metered(client, "index")
+    # Requests that miss every cache at the same time only go to lsproxy once
+    client = metered(SingleFlightClient(client), "single_flight")
+    workspace_root = workspace.root if workspace is not None else None
+    return metered(CachedDefinitionsClient(client, workspace_root=workspace_root), "api_client")
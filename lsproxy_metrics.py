@@ -0,0 +1,275 @@
+"""
+Count and time the calls an lsproxy client makes, and where they're answered.
+
+`MeteredClient` goes around each layer of a client stack (caches, single-flighting, the HTTP client) and
+records the calls that reach that layer, so comparing neighbouring layers gives each cache's hit rate.
+`PooledLsproxy` reports every call it sends over HTTP, with payload sizes and how many attempts it took,
+through its `hooks`.
+
+Calls are tagged with the analysis that made them, set with `with metrics.analysis("example_2"):`. The
+tag is a context variable, so it follows calls onto worker threads that run in a copy of the caller's
+context, like `fan_out` and `AsyncLsproxy` do.
+
+The numbers can be exported as JSON or in Prometheus' text format.
+"""
+
+import contextlib
+import contextvars
+import json
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+_current_analysis = contextvars.ContextVar("lsproxy_analysis", default="other")
+
+
+class _Series:
+    """Count, latency histogram and payload sizes for one (layer, call, analysis)."""
+
+    __slots__ = ("count", "errors", "seconds", "buckets", "request_bytes", "response_bytes", "attempts")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.request_bytes = 0
+        self.response_bytes = 0
+        # HTTP requests sent, more than `count` when calls were retried
+        self.attempts = 0
+
+    def quantile(self, fraction: float) -> float:
+        """Upper bound of the bucket the `fraction` quantile of latencies falls in."""
+        if not self.count:
+            return 0.0
+        rank, seen = fraction * self.count, 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return LATENCY_BUCKETS[-1]
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "seconds": self.seconds,
+            "buckets": {str(bound): count for bound, count in zip(LATENCY_BUCKETS, self.buckets)},
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+            "attempts": self.attempts,
+        }
+
+
+class Metrics:
+    """
+    Thread-safe store of the calls made through metered clients.
+
+    Layers are listed from the outside in. Client stacks are built from the inside out, so each layer a
+    `MeteredClient` registers is taken to wrap the ones registered before it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str, str], _Series] = {}
+        self.layers: List[str] = []
+
+    @contextlib.contextmanager
+    def analysis(self, name: str):
+        """Tag the calls made inside the block, including on worker threads started from it, with `name`."""
+        token = _current_analysis.set(name)
+        try:
+            yield
+        finally:
+            _current_analysis.reset(token)
+
+    def register_layer(self, layer: str):
+        with self._lock:
+            if layer not in self.layers:
+                self.layers.insert(0, layer)
+
+    def observe(
+        self,
+        layer: str,
+        call: str,
+        seconds: float,
+        error: bool = False,
+        request_bytes: int = 0,
+        response_bytes: int = 0,
+        attempts: int = 1,
+    ):
+        """Record one call into `layer`, tagged with the current analysis."""
+        key = (layer, call, _current_analysis.get())
+        bucket = bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series()
+            series.count += 1
+            series.errors += error
+            series.seconds += seconds
+            series.buckets[bucket] += 1
+            series.request_bytes += request_bytes
+            series.response_bytes += response_bytes
+            series.attempts += attempts
+
+    def observe_http(
+        self, call: str, seconds: float, status: int, request_bytes: int, response_bytes: int, attempts: int = 1
+    ):
+        """
+        Hook for `PooledLsproxy.hooks`, recording its calls as the "http" layer.
+
+        Retries count as one call, like in every other layer, so cache hit rates compare like with like.
+        """
+        failed = status == 0 or status >= 400
+        self.observe("http", call, seconds, failed, request_bytes, response_bytes, attempts)
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def summary(self) -> List[dict]:
+        """
+        One row per (analysis, call), for showing in a table.
+
+        The "into" columns count the calls that reached each layer, from the outside in, so the difference
+        between two neighbouring columns is what the first of them answered itself.
+        """
+        with self._lock:
+            series = dict(self._series)
+            layers = list(self.layers) + (["http"] if any(key[0] == "http" for key in series) else [])
+        rows = []
+        for analysis, call in sorted({(key[2], key[1]) for key in series}):
+            layer_series = [series.get((layer, call, analysis)) or _Series() for layer in layers]
+            # The first layer the call went through, and the last one, which sent it to lsproxy
+            outermost = next(s for s in layer_series if s.count)
+            innermost = layer_series[-1]
+            row = {"analysis": analysis, "call": call}
+            row.update({f"into {layer}": s.count for layer, s in zip(layers, layer_series)})
+            row.update(
+                {
+                    "cache hit rate": round(1 - innermost.count / outermost.count, 3),
+                    "mean ms": round(1000 * outermost.seconds / outermost.count, 2),
+                    "p95 ms (at most)": 1000 * outermost.quantile(0.95),
+                    "response KB": round(innermost.response_bytes / 1024, 1),
+                }
+            )
+            if "http" in layers:
+                row["http retries"] = innermost.attempts - innermost.count
+            rows.append(row)
+        return rows
+
+    def to_json(self) -> str:
+        with self._lock:
+            data = [
+                dict(layer=layer, call=call, analysis=analysis, **series.as_dict())
+                for (layer, call, analysis), series in sorted(self._series.items())
+            ]
+        return json.dumps({"layers": self.layers, "series": data}, indent=2)
+
+    def to_prometheus(self) -> str:
+        """The metrics in Prometheus' text exposition format."""
+        with self._lock:
+            series = sorted(self._series.items())
+        lines = [
+            "# HELP lsproxy_calls_total Calls into each layer of the lsproxy client.",
+            "# TYPE lsproxy_calls_total counter",
+        ]
+        for (layer, call, analysis), s in series:
+            lines.append(f'lsproxy_calls_total{{{_labels(layer, call, analysis)}}} {s.count}')
+        lines += [
+            "# HELP lsproxy_call_errors_total Calls into each layer of the lsproxy client that failed.",
+            "# TYPE lsproxy_call_errors_total counter",
+        ]
+        for (layer, call, analysis), s in series:
+            lines.append(f'lsproxy_call_errors_total{{{_labels(layer, call, analysis)}}} {s.errors}')
+        lines += [
+            "# HELP lsproxy_call_seconds Time taken by calls into each layer of the lsproxy client.",
+            "# TYPE lsproxy_call_seconds histogram",
+        ]
+        for (layer, call, analysis), s in series:
+            labels = _labels(layer, call, analysis)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, s.buckets):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'lsproxy_call_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"lsproxy_call_seconds_sum{{{labels}}} {s.seconds}")
+            lines.append(f"lsproxy_call_seconds_count{{{labels}}} {s.count}")
+        for direction in ("request", "response"):
+            lines += [
+                f"# HELP lsproxy_http_{direction}_bytes_total Bytes in the bodies of HTTP {direction}s to lsproxy.",
+                f"# TYPE lsproxy_http_{direction}_bytes_total counter",
+            ]
+            for (layer, call, analysis), s in series:
+                if layer == "http":
+                    total = s.request_bytes if direction == "request" else s.response_bytes
+                    lines.append(
+                        f"lsproxy_http_{direction}_bytes_total{{{_labels(layer, call, analysis)}}} {total}"
+                    )
+        lines += [
+            "# HELP lsproxy_http_attempts_total HTTP requests sent to lsproxy, including retries.",
+            "# TYPE lsproxy_http_attempts_total counter",
+        ]
+        for (layer, call, analysis), s in series:
+            if layer == "http":
+                lines.append(f"lsproxy_http_attempts_total{{{_labels(layer, call, analysis)}}} {s.attempts}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(layer: str, call: str, analysis: str) -> str:
+    def escape(value):
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return f'layer="{escape(layer)}",call="{escape(call)}",analysis="{escape(analysis)}"'
+
+
+class MeteredClient:
+    """
+    Wrap one layer of an lsproxy client stack, recording every call that reaches it in `metrics`.
+
+    `symbol_index` is counted as a `definitions_in_file` call, since that's what answers it underneath.
+    """
+
+    def __init__(self, client, metrics: Metrics, layer: str):
+        self._client = client
+        self._metrics = metrics
+        self._layer = layer
+        metrics.register_layer(layer)
+
+    def _call(self, call: str, method: str, *args):
+        started = time.perf_counter()
+        error = False
+        try:
+            return getattr(self._client, method)(*args)
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._metrics.observe(self._layer, call, time.perf_counter() - started, error)
+
+    def definitions_in_file(self, file_path):
+        return self._call("definitions_in_file", "definitions_in_file", file_path)
+
+    def symbol_index(self, file_path):
+        return self._call("definitions_in_file", "symbol_index", file_path)
+
+    def find_definition(self, request):
+        return self._call("find_definition", "find_definition", request)
+
+    def find_references(self, request):
+        return self._call("find_references", "find_references", request)
+
+    def read_source_code(self, request):
+        return self._call("read_source_code", "read_source_code", request)
+
+    def list_files(self):
+        return self._call("list_files", "list_files")
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
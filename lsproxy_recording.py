@@ -0,0 +1,330 @@
+"""
+Record the requests an lsproxy client makes, and answer them again later without lsproxy.
+
+A `Recording` maps each request to the JSON of its response. `RecordingClient` fills one in while
+passing calls through to a real client, and `ReplayLsproxy` answers from it, optionally after a fixed
+delay to stand in for the language servers. That makes runs reproducible, e.g. for `benchmark.py`.
+
+The tutorial records everything it asks lsproxy when LSPROXY_RECORD is set to a file, and this module
+can serve a recording over HTTP in place of lsproxy, with injected latency, so the tutorial and load
+tests run without Docker or language servers:
+
+    python lsproxy_recording.py serve --recording bench/recording.json.gz --port 4444 --latency 0.02
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from lsproxy import (
+    DefinitionResponse,
+    FileRange,
+    GetDefinitionRequest,
+    GetReferencesRequest,
+    ReferencesResponse,
+    Symbol,
+)
+from lsproxy.models import ReadSourceCodeResponse
+
+
+def _request_params(kind: str, *args) -> str:
+    # How each call is keyed: the file for definitions_in_file, the request body for the rest
+    if kind == "definitions_in_file":
+        return args[0]
+    if kind == "list_files":
+        return ""
+    return args[0].model_dump_json()
+
+
+def _dump_response(kind: str, response) -> str:
+    if kind == "definitions_in_file":
+        return json.dumps([symbol.model_dump() for symbol in response])
+    if kind == "list_files":
+        return json.dumps(response)
+    return response.model_dump_json()
+
+
+def _load_response(kind: str, data: str):
+    if kind == "definitions_in_file":
+        return [Symbol.model_validate(symbol) for symbol in json.loads(data)]
+    if kind == "list_files":
+        return json.loads(data)
+    response_type = {
+        "find_definition": DefinitionResponse,
+        "find_references": ReferencesResponse,
+        "read_source_code": ReadSourceCodeResponse,
+    }[kind]
+    return response_type.model_validate_json(data)
+
+
+class Recording:
+    """
+    Responses to lsproxy requests, keyed by (kind of call, request).
+
+    Anything else a run depends on, like the text of a diff, can be stored alongside under a kind of
+    its own with `add` and `get`.
+    """
+
+    def __init__(self, responses: Optional[Dict[Tuple[str, str], str]] = None):
+        self.responses = responses if responses is not None else {}
+
+    def __len__(self):
+        return len(self.responses)
+
+    def add(self, kind: str, params: str, response: str):
+        self.responses[(kind, params)] = response
+
+    def get(self, kind: str, params: str) -> str:
+        try:
+            return self.responses[(kind, params)]
+        except KeyError:
+            raise LookupError(f"No recorded response for {kind}({params})") from None
+
+    def save(self, path: str):
+        """Write the recording as gzipped JSON lines, replacing it atomically."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        partial_path = f"{path}.partial"
+        with gzip.open(partial_path, "wt", encoding="utf-8") as f:
+            for (kind, params), response in sorted(self.responses.items()):
+                f.write(json.dumps([kind, params, response]) + "\n")
+        os.replace(partial_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Recording":
+        """
+        Read a recording written by `save` or a `RecordingClient`.
+
+        A file a `RecordingClient` was still appending to when its process stopped is read up to the
+        last complete response.
+        """
+        responses = {}
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    kind, params, response = json.loads(line)
+                    responses[(kind, params)] = response
+            except (EOFError, ValueError):
+                pass
+        return cls(responses)
+
+
+class RecordingClient:
+    """
+    Pass calls through to an lsproxy client, saving every response in `recording`.
+
+    With a `path`, responses are also appended to that file as they come in, so it's usable even if the
+    process never gets to call `save`. Responses already in the file are loaded first and kept.
+    """
+
+    def __init__(self, client, recording: Optional[Recording] = None, path: Optional[str] = None):
+        self._client = client
+        self.recording = recording if recording is not None else Recording()
+        self._lock = threading.Lock()
+        self._file = None
+        if path is not None:
+            if os.path.exists(path):
+                self.recording.responses.update(Recording.load(path).responses)
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # Every run appends a new gzip member, which gzip reads back as one stream
+            self._file = gzip.open(path, "at", encoding="utf-8")
+
+    def _call(self, kind: str, *args):
+        response = getattr(self._client, kind)(*args)
+        params, data = _request_params(kind, *args), _dump_response(kind, response)
+        with self._lock:
+            new = (kind, params) not in self.recording.responses
+            self.recording.add(kind, params, data)
+            if new and self._file is not None:
+                self._file.write(json.dumps([kind, params, data]) + "\n")
+                self._file.flush()
+        return response
+
+    def definitions_in_file(self, file_path: str) -> List[Symbol]:
+        return self._call("definitions_in_file", file_path)
+
+    def find_definition(self, request: GetDefinitionRequest) -> DefinitionResponse:
+        return self._call("find_definition", request)
+
+    def find_references(self, request: GetReferencesRequest) -> ReferencesResponse:
+        return self._call("find_references", request)
+
+    def read_source_code(self, request: FileRange) -> ReadSourceCodeResponse:
+        return self._call("read_source_code", request)
+
+    def list_files(self) -> List[str]:
+        return self._call("list_files")
+
+    def close(self):
+        """Finish writing the file, if there is one."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class ReplayLsproxy:
+    """
+    Stand-in for an lsproxy client that answers from a `Recording`.
+
+    Each call waits `latency` seconds before answering, like a language server would, and requests
+    that weren't recorded raise LookupError.
+    """
+
+    def __init__(self, recording: Recording, latency: float = 0.0):
+        self.recording = recording
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+
+    def _call(self, kind: str, *args):
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        return _load_response(kind, self.recording.get(kind, _request_params(kind, *args)))
+
+    def definitions_in_file(self, file_path: str) -> List[Symbol]:
+        return self._call("definitions_in_file", file_path)
+
+    def find_definition(self, request: GetDefinitionRequest) -> DefinitionResponse:
+        return self._call("find_definition", request)
+
+    def find_references(self, request: GetReferencesRequest) -> ReferencesResponse:
+        return self._call("find_references", request)
+
+    def read_source_code(self, request: FileRange) -> ReadSourceCodeResponse:
+        return self._call("read_source_code", request)
+
+    def list_files(self) -> List[str]:
+        return self._call("list_files")
+
+
+# The lsproxy endpoints the client calls, and the request model behind each POST body
+ENDPOINTS = {
+    ("GET", "/v1/symbol/definitions-in-file"): "definitions_in_file",
+    ("POST", "/v1/symbol/find-definition"): "find_definition",
+    ("POST", "/v1/symbol/find-references"): "find_references",
+    ("GET", "/v1/workspace/list-files"): "list_files",
+    ("POST", "/v1/workspace/read-source-code"): "read_source_code",
+}
+REQUEST_TYPES = {
+    "find_definition": GetDefinitionRequest,
+    "find_references": GetReferencesRequest,
+    "read_source_code": FileRange,
+}
+
+
+def make_server(
+    recording: Recording,
+    host: str = "127.0.0.1",
+    port: int = 4444,
+    latency: float = 0.0,
+    jitter: float = 0.0,
+) -> ThreadingHTTPServer:
+    """
+    An HTTP server that answers lsproxy's API from `recording`.
+
+    Every response waits `latency` seconds, plus up to `jitter` more at random. Each connection gets its
+    own thread and connections are kept alive, so it keeps up with a pooled client at high concurrency.
+    Requests that weren't recorded get a 404.
+    """
+
+    class ReplayHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            # Headers and body are written separately, don't let Nagle hold the body back on kept-alive connections
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def _respond(self, status: int, body: str):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _handle(self, method: str):
+            url = urlsplit(self.path)
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            # run_locally.sh waits for this to answer before starting the tutorial
+            if url.path == "/api-docs/openapi.json":
+                return self._respond(200, "{}")
+            kind = ENDPOINTS.get((method, url.path))
+            if kind is None:
+                return self._respond(404, json.dumps({"error": f"Unknown endpoint {method} {url.path}"}))
+            if kind == "definitions_in_file":
+                params = parse_qs(url.query).get("file_path", [""])[0]
+            elif kind == "list_files":
+                params = ""
+            else:
+                params = REQUEST_TYPES[kind].model_validate_json(body).model_dump_json()
+
+            delay = latency + random.uniform(0, jitter)
+            if delay:
+                time.sleep(delay)
+            try:
+                self._respond(200, recording.get(kind, params))
+            except LookupError as error:
+                self._respond(404, json.dumps({"error": str(error)}))
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), ReplayHandler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Serve a recording in place of lsproxy")
+    serve_parser.add_argument(
+        "--recording",
+        default=os.environ.get("LSPROXY_RECORD", os.path.join("bench", "recording.json.gz")),
+        help="Recording to serve, from benchmark.py or the tutorial's LSPROXY_RECORD",
+    )
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=4444)
+    serve_parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each response")
+    serve_parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many more seconds, at random")
+    args = parser.parse_args()
+
+    recording = Recording.load(args.recording)
+    server = make_server(recording, args.host, args.port, args.latency, args.jitter)
+    print(
+        f"Serving {len(recording)} recorded responses on http://{args.host}:{args.port}/v1",
+        file=sys.stderr,
+        flush=True,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,324 @@
+"""
+lsproxy clients tuned for sending lots of requests at once.
+
+`Lsproxy` from the SDK shares one HTTP client between all its instances, with a fixed pool and a slow,
+unjittered retry policy. `PooledLsproxy` is a drop-in replacement with its own keep-alive pool sized to
+the concurrency you plan to use, per-endpoint timeouts, jittered retries of transient failures, and a
+fair share of the pool for each language server so one language can't starve the others.
+
+`AsyncLsproxy` makes any of these clients awaitable, so requests can be combined with `asyncio.gather`,
+and `fan_out` sends calls from a bounded thread pool for code that isn't async.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+
+import httpx
+from lsproxy import (
+    DefinitionResponse,
+    FileRange,
+    GetDefinitionRequest,
+    GetReferencesRequest,
+    Lsproxy,
+    ReferencesResponse,
+    Symbol,
+)
+from lsproxy.models import ReadSourceCodeResponse
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+LANGUAGE_BY_EXTENSION = {
+    "py": "python",
+    "ts": "typescript_javascript",
+    "tsx": "typescript_javascript",
+    "js": "typescript_javascript",
+    "jsx": "typescript_javascript",
+    "rs": "rust",
+}
+
+
+# Which client method each endpoint answers, for reporting requests to `PooledLsproxy.hooks`
+ENDPOINT_CALLS = {
+    "/symbol/definitions-in-file": "definitions_in_file",
+    "/symbol/find-definition": "find_definition",
+    "/symbol/find-references": "find_references",
+    "/workspace/list-files": "list_files",
+    "/workspace/read-source-code": "read_source_code",
+}
+
+
+def language_of(file_path: Optional[str]) -> str:
+    """The language server lsproxy routes requests about `file_path` to."""
+    if not file_path:
+        return "other"
+    return LANGUAGE_BY_EXTENSION.get(os.path.splitext(file_path)[1].lstrip("."), "other")
+
+
+def _is_transient(error: BaseException) -> bool:
+    # Connection problems, timeouts, and the server being busy or restarting are worth another try
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return False
+
+
+def _request_path(kwargs) -> Optional[str]:
+    # Find the file a request is about, whichever endpoint it's for
+    params = kwargs.get("params") or {}
+    if "file_path" in params:
+        return params["file_path"]
+    body = kwargs.get("json") or {}
+    for key in ("identifier_position", "position"):
+        if isinstance(body.get(key), dict):
+            return body[key].get("path")
+    return body.get("path")
+
+
+def _error_message(response: httpx.Response) -> str:
+    """The error lsproxy sent back, which is JSON unless something in between answered instead."""
+    try:
+        body = response.json()
+    except ValueError:
+        return response.text
+    if isinstance(body, dict) and "error" in body:
+        return str(body["error"])
+    return response.text
+
+
+class _LanguageSlots:
+    """
+    Requests allowed in flight at once, shared fairly between language servers.
+
+    A language can use every slot while no other language is waiting. Once others are, each slot that
+    frees up goes to the waiting language with the fewest requests in flight, so a busy language server
+    gives up connections as its requests finish instead of keeping them for its own queue.
+    """
+
+    def __init__(self, size: int, per_language: Optional[int] = None):
+        self._size = size
+        self._per_language = per_language or size
+        self._condition = threading.Condition()
+        self._in_flight = Counter()
+        self._waiting = Counter()
+
+    def _may_start(self, language: str) -> bool:
+        if sum(self._in_flight.values()) >= self._size:
+            return False
+        if self._in_flight[language] >= self._per_language:
+            return False
+        return all(
+            self._in_flight[language] <= self._in_flight[other]
+            for other, waiting in self._waiting.items()
+            if waiting and other != language
+        )
+
+    @contextlib.contextmanager
+    def hold(self, language: str):
+        with self._condition:
+            self._waiting[language] += 1
+            try:
+                self._condition.wait_for(lambda: self._may_start(language))
+            finally:
+                self._waiting[language] -= 1
+            self._in_flight[language] += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight[language] -= 1
+                self._condition.notify_all()
+
+
+class PooledLsproxy(Lsproxy):
+    """
+    `Lsproxy` with its own connection pool and retry policy.
+
+    Args:
+        base_url: Where lsproxy is running
+        timeout: Default timeout for a request, in seconds
+        pool_size: Number of connections to keep open, set it to the number of concurrent requests
+        max_in_flight_per_language: Requests that can be waiting on one language server at once.
+            Without it a language can use the whole pool while it's the only one with requests, and
+            shares it evenly with the others once they have requests waiting
+        endpoint_timeouts: Timeouts for specific endpoints, e.g. {"/symbol/find-references": 60}
+        max_attempts: Attempts per request, including the first
+        backoff_seconds: Base of the exponential backoff between attempts, which is randomized
+        max_backoff_seconds: Longest wait between attempts
+        hooks: Functions called once per call, after its last attempt, with the name of the client
+            method, the seconds all its attempts took, the status of the last one (0 if no response came
+            back), the sizes of the request and response bodies summed over the attempts, and the number
+            of attempts. More can be appended to `hooks` later.
+    """
+
+    def __init__(
+        self,
+        base_url: str = "http://localhost:4444/v1",
+        timeout: float = 10.0,
+        pool_size: int = 16,
+        max_in_flight_per_language: Optional[int] = None,
+        endpoint_timeouts: Optional[Dict[str, float]] = None,
+        max_attempts: int = 3,
+        backoff_seconds: float = 0.5,
+        max_backoff_seconds: float = 8.0,
+        hooks: Optional[List[Callable[[str, float, int, int, int, int], None]]] = None,
+    ):
+        # Not calling super().__init__, it reconfigures the client shared by every Lsproxy
+        self._client = httpx.Client(
+            base_url=base_url,
+            timeout=timeout,
+            headers={"Content-Type": "application/json"},
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=60,
+            ),
+        )
+        self._endpoint_timeouts = endpoint_timeouts or {}
+        self.hooks = list(hooks or [])
+        self._language_slots = _LanguageSlots(pool_size, max_in_flight_per_language)
+        self._retrying = Retrying(
+            stop=stop_after_attempt(max_attempts),
+            wait=wait_random_exponential(multiplier=backoff_seconds, max=max_backoff_seconds),
+            retry=retry_if_exception(_is_transient),
+            reraise=True,
+        )
+
+    def _send(
+        self, method: str, endpoint: str, responses: List[Optional[httpx.Response]], **kwargs
+    ) -> httpx.Response:
+        with self._language_slots.hold(language_of(_request_path(kwargs))):
+            response = None
+            try:
+                response = self._client.request(method, endpoint, **kwargs)
+            finally:
+                responses.append(response)
+        if response.status_code == 400:
+            raise ValueError(_error_message(response))
+        response.raise_for_status()
+        return response
+
+    def _report(self, endpoint: str, seconds: float, responses: List[Optional[httpx.Response]]):
+        call = ENDPOINT_CALLS.get(endpoint, endpoint)
+        received = [response for response in responses if response is not None]
+        status = responses[-1].status_code if responses and responses[-1] is not None else 0
+        request_bytes = sum(len(response.request.content) for response in received)
+        response_bytes = sum(len(response.content) for response in received)
+        for hook in self.hooks:
+            hook(call, seconds, status, request_bytes, response_bytes, len(responses))
+
+    def _request(self, method: str, endpoint: str, **kwargs) -> httpx.Response:
+        """Make an HTTP request, retrying transient failures with jittered backoff."""
+        if endpoint in self._endpoint_timeouts:
+            kwargs.setdefault("timeout", self._endpoint_timeouts[endpoint])
+        # The response to each attempt, None for one that got no response
+        responses: List[Optional[httpx.Response]] = []
+        started = time.perf_counter()
+        try:
+            return self._retrying(self._send, method, endpoint, responses, **kwargs)
+        finally:
+            if self.hooks:
+                self._report(endpoint, time.perf_counter() - started, responses)
+
+    def close(self):
+        """Close the connection pool."""
+        self._client.close()
+
+
+class AsyncLsproxy:
+    """
+    Awaitable versions of an lsproxy client's calls.
+
+    Each call runs the wrapped client on a worker thread, so whatever caching it does still applies, and
+    at most `max_concurrency` requests are in flight no matter how many calls are awaited together.
+    Cancelling a call that hasn't started yet means it's never sent.
+    """
+
+    def __init__(self, client, max_concurrency: int = 16):
+        self._client = client
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="lsproxy"
+        )
+
+    async def _call(self, method: str, *args):
+        loop = asyncio.get_running_loop()
+        # Run in a copy of the caller's context, so context variables (e.g. metrics tags) carry over
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(context.run, getattr(self._client, method), *args)
+        )
+
+    async def definitions_in_file(self, file_path: str) -> List[Symbol]:
+        """Retrieve symbols from a specific file."""
+        return await self._call("definitions_in_file", file_path)
+
+    async def find_definition(self, request: GetDefinitionRequest) -> DefinitionResponse:
+        """Get the definition of a symbol at a specific position in a file."""
+        return await self._call("find_definition", request)
+
+    async def find_references(self, request: GetReferencesRequest) -> ReferencesResponse:
+        """Find all references to a symbol."""
+        return await self._call("find_references", request)
+
+    async def list_files(self) -> List[str]:
+        """Get a list of all files in the workspace."""
+        return await self._call("list_files")
+
+    async def read_source_code(self, request: FileRange) -> ReadSourceCodeResponse:
+        """Read source code from a specified file range."""
+        return await self._call("read_source_code", request)
+
+    def close(self):
+        """Stop the worker threads, dropping calls that haven't started."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def fan_out(fn, items, max_workers: int = 16, cancel_event: Optional[threading.Event] = None):
+    """
+    Call `fn` on every item from a bounded thread pool and yield `(index, result)` pairs as they complete.
+
+    At most `max_workers` calls are in flight at once, so lsproxy sees a steady number of requests
+    no matter how many items there are. Setting `cancel_event`, an exception in a call, or the caller
+    stopping iteration (e.g. interrupting the cell) drops every call that hasn't started yet.
+    Calls run in a copy of the caller's context, so context variables (e.g. metrics tags) carry over.
+
+    Args:
+        fn: Function to call with each item, usually wrapping a single lsproxy request
+        items: Sequence of items to process
+        max_workers: Maximum number of concurrent calls
+        cancel_event: Optional `threading.Event` that stops the fan-out when set
+    Yields:
+        Tuples of (index into items, result of fn), in completion order
+    """
+    pending_items = iter(enumerate(items))
+    in_flight = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit_next():
+        for index, item in pending_items:
+            in_flight[executor.submit(contextvars.copy_context().run, fn, item)] = index
+            return
+
+    try:
+        for _ in range(max_workers):
+            submit_next()
+        while in_flight:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            # Wake up periodically so a cancel_event is noticed even if lsproxy is slow
+            done, _ = wait(in_flight, timeout=0.2, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = in_flight.pop(future)
+                submit_next()
+                yield index, future.result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
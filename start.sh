@@ -4,6 +4,10 @@ cd /app
 /lsproxy &
 LSPROXY_PID=$!
 
+# Index the workspace in the background once lsproxy is up, the tutorial picks the index up when it's ready
+python3 workspace_index.py &
+INDEXER_PID=$!
+
 marimo run tutorial.py --host 0.0.0.0 --port 7860 &
 MARIMO_PID=$!
 
@@ -12,6 +16,8 @@ cleanup() {
     echo "Shutting down processes..."
     kill $LSPROXY_PID
     kill $MARIMO_PID
+    # The indexer exits by itself once it's done, so it may not be running any more
+    kill $INDEXER_PID 2>/dev/null
     exit 0
 }
 
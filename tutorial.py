@@ -6,11 +6,10 @@ app = marimo.App(width="medium", app_title="lsproxy tutorial")
 
 @app.cell
 def __():
-    import requests
     import json
     import sys
     import os
-    from typing import Dict, Any, Optional, List
+    from typing import Dict, Any, Optional, List, Set, Tuple
 
     from lsproxy import GetReferencesRequest, FileRange, Position
 
@@ -24,11 +23,12 @@ def __():
         List,
         Optional,
         Position,
+        Set,
+        Tuple,
         get_example1_unlocked,
         json,
         mo,
         os,
-        requests,
         set_example1_unlocked,
         sys,
     )
@@ -54,14 +54,31 @@ def __():
 
 
 @app.cell
-def __(mo, os):
-    # The first step is to create our API client
-    from lsproxy import Lsproxy
+def __(MAX_CONCURRENT_REQUESTS, mo, os, wrap_client):
+    # The first step is to create our API client.
+    # PooledLsproxy is the lsproxy client with a connection pool and retries tuned for concurrent requests
+    from lsproxy_metrics import Metrics
+    from lsproxy_transport import PooledLsproxy
+    from workspace_index import Workspace
 
     # Connect to wherever you're running lsproxy
-    api_client = Lsproxy(base_url=os.environ.get("BASE_URL"))
+    # (we also cache the responses so we never ask lsproxy the same thing twice, see Appendix E,
+    # and count every call each cache answers, see Appendix G)
+    api_metrics = Metrics()
+    # The checkout lsproxy serves, if we have it, tells the caches when the code changes
+    workspace = (
+        Workspace(os.environ["CHECKOUT_LOCATION"]) if os.environ.get("CHECKOUT_LOCATION") else None
+    )
+    api_client = wrap_client(
+        PooledLsproxy(
+            base_url=os.environ.get("BASE_URL"),
+            pool_size=MAX_CONCURRENT_REQUESTS,
+        ),
+        workspace=workspace,
+        metrics=api_metrics,
+    )
     mo.show_code()
-    return Lsproxy, api_client
+    return Metrics, PooledLsproxy, Workspace, api_client, api_metrics, workspace
 
 
 @app.cell
@@ -120,9 +137,10 @@ def __(code_language_ex1, get_example1_unlocked, mo):
 
 
 @app.cell
-def __(api_client, mo, selected_file_ex1):
+def __(api_client, api_metrics, mo, selected_file_ex1):
     # Retrieving the symbols defined in a file is just a single call
-    symbols_ex1 = api_client.definitions_in_file(selected_file_ex1)
+    with api_metrics.analysis("example_1"):
+        symbols_ex1 = api_client.definitions_in_file(selected_file_ex1)
 
     mo.show_code()
     return (symbols_ex1,)
@@ -167,6 +185,7 @@ def __(
     FileRange,
     GetReferencesRequest,
     api_client,
+    api_metrics,
     mo,
     selected_file_ex1,
     selected_symbol_ex1,
@@ -177,10 +196,11 @@ def __(
         start=selected_symbol_ex1.range.start,
         end=selected_symbol_ex1.range.end,
     )
-    source_code_ex1 = api_client.read_source_code(file_range_ex1).source_code
+    with api_metrics.analysis("example_1"):
+        source_code_ex1 = api_client.read_source_code(file_range_ex1).source_code
 
     # Get references to the symbol and optionally include context lines surrounding the usage
-    with mo.status.spinner():
+    with mo.status.spinner(), api_metrics.analysis("example_1"):
         reference_request_ex1 = GetReferencesRequest(
             identifier_position=selected_symbol_ex1.identifier_position,
             include_code_context_lines=2,
@@ -268,48 +288,79 @@ def __(ex2_unlocked, file_dropdown_2, mo):
 
 
 @app.cell
-def __(api_client, mo, selected_file_ex2):
+def __(api_client, api_metrics, mo, selected_file_ex2):
     # As before we can get all of the symbols from a file
-    symbols_ex2 = api_client.definitions_in_file(selected_file_ex2)
+    with api_metrics.analysis("example_2"):
+        symbols_ex2 = api_client.definitions_in_file(selected_file_ex2)
     mo.show_code()
     return (symbols_ex2,)
 
 
 @app.cell
-def __(
+async def __(
     GetReferencesRequest,
-    api_client,
+    api_metrics,
+    async_api_client,
+    async_fan_out,
+    generate_reference_diagram,
     mo,
     selected_file_ex2,
     symbols_ex2,
+    throttle,
 ):
-    # But now we can repeatedly look for references on EVERY symbol in the file and build up a graph of the references
-    referenced_symbols_in_file_dict = {}
-    for symbol in mo.status.progress_bar(
-        symbols_ex2, title="Symbols processed", remove_on_exit=True
-    ):
+    # But now we can look for references on EVERY symbol in the file and build up a graph of the references.
+    # The requests are independent, so we await them all together and lsproxy works on them concurrently
+    # (see Appendix D for `async_fan_out`)
+    async def find_references_ex2(symbol):
         reference_request_ex2 = GetReferencesRequest(
             identifier_position=symbol.identifier_position,
         )
-        references_ex2 = api_client.find_references(
-            reference_request_ex2
-        ).references
-
-        # Save which symbols were referenced by which file
-        for ref in references_ex2:
-            referencing_file = ref.path
-            if referencing_file != selected_file_ex2:
-                referenced_symbols_in_file_dict.setdefault(
-                    (selected_file_ex2, referencing_file), set()
-                ).add(symbol.name)
+        return (await async_api_client.find_references(reference_request_ex2)).references
+
+
+    def referenced_symbols_ex2(references_by_symbol):
+        # Save which symbols were referenced by which file, in the same order as the symbols
+        referenced_symbols = {}
+        for symbol_number, symbol in enumerate(symbols_ex2):
+            for ref in references_by_symbol.get(symbol_number, []):
+                referencing_file = ref.path
+                if referencing_file != selected_file_ex2:
+                    referenced_symbols.setdefault(
+                        (selected_file_ex2, referencing_file), set()
+                    ).add(symbol.name)
+        return referenced_symbols
+
+
+    # The graph is redrawn under the progress bar every second, so it fills in while the requests come back
+    references_by_symbol_ex2 = {}
+    redraw_ex2 = throttle(seconds=1)
+    with api_metrics.analysis("example_2"), mo.status.progress_bar(
+        total=len(symbols_ex2), title="Symbols processed", remove_on_exit=True
+    ) as progress_ex2:
+        async for index_ex2, references_ex2 in async_fan_out(
+            find_references_ex2, symbols_ex2
+        ):
+            references_by_symbol_ex2[index_ex2] = references_ex2
+            progress_ex2.update()
+            if redraw_ex2():
+                referenced_so_far_ex2 = referenced_symbols_ex2(references_by_symbol_ex2)
+                if referenced_so_far_ex2:
+                    mo.output.replace_at_index(
+                        mo.mermaid(generate_reference_diagram(referenced_so_far_ex2)), 1
+                    )
+
+    referenced_symbols_in_file_dict = referenced_symbols_ex2(references_by_symbol_ex2)
     mo.show_code()
     return (
-        ref,
-        reference_request_ex2,
+        find_references_ex2,
+        index_ex2,
+        progress_ex2,
+        redraw_ex2,
+        referenced_so_far_ex2,
+        referenced_symbols_ex2,
         referenced_symbols_in_file_dict,
+        references_by_symbol_ex2,
         references_ex2,
-        referencing_file,
-        symbol,
     )
 
 
@@ -370,52 +421,55 @@ def __(example_3, mo):
 @app.cell
 def __(example_3, mo):
     mo.stop(not example_3.value)
-    import subprocess
-    import io
-    from pydantic import BaseModel
     mo.md("""Let's start with a diff of a change to the deletion logic in Trieve in this [PR](https://github.com/devflowinc/trieve/pull/2649)""")
-    return BaseModel, io, subprocess
+    return
 
 
 @app.cell
-def __(os, subprocess):
+def __(os):
     parent_commit = "1910d6867877bfdd64ca822e266372335392a8be"
     checkout_location = os.environ.get("CHECKOUT_LOCATION")
-    # Load in the diff
-    diff_text = subprocess.check_output(
-        ["git", "diff", parent_commit], cwd=checkout_location
-    ).decode("utf-8")
-    return checkout_location, diff_text, parent_commit
+    return checkout_location, parent_commit
 
 
 @app.cell
-def __(Dict, List, Tuple, diff_text, io, mo):
-    from unidiff import PatchSet
+def __(example_3, mo, workspace):
+    mo.stop(not example_3.value)
+    # The diff is against the checkout as it is now, so look for edits to it every few seconds
+    get_workspace_version, set_workspace_version = mo.state(
+        workspace.version if workspace is not None else None
+    )
+    workspace_refresh = None if workspace is None else mo.ui.refresh(default_interval="5s")
+    workspace_refresh
+    return get_workspace_version, set_workspace_version, workspace_refresh
 
 
-    def parse_diff(diff_text) -> Tuple[Dict[str, List[int]], str]:
-        patch = PatchSet(io.StringIO(diff_text))
-        affected_lines = {}
-        for patched_file in patch:
-            for hunk in patched_file:
-                for line in hunk:
-                    if line.is_added:
-                        affected_lines.setdefault(patched_file.path, set()).add(
-                            line.target_line_no
-                        )
-                    elif line.is_removed:
-                        affected_lines.setdefault(patched_file.path, set()).add(
-                            line.source_line_no
-                        )
-        return affected_lines
+@app.cell
+def __(get_workspace_version, set_workspace_version, workspace, workspace_refresh):
+    workspace_refresh
+    if workspace_refresh is not None:
+        _version = workspace.version
+        # Example 3 is redone from here on, so only when something was edited
+        if _version != get_workspace_version():
+            set_workspace_version(_version)
+    return
 
 
-    affected_lines = parse_diff(diff_text)
+@app.cell
+def __(checkout_location, example_3, get_workspace_version, mo, parent_commit):
+    mo.stop(not example_3.value)
+    # Read the diff straight from git, one hunk at a time, keeping just the ranges of lines each file changes.
+    # Renamed files are followed to their new path, and line numbers are those of the code lsproxy serves.
+    # It's read again whenever the checkout is edited, and Example 3 only looks up what the edit touched
+    get_workspace_version()
+    from git_diff import git_diff_lines, parse_diff
+
+    affected_lines = parse_diff(git_diff_lines(checkout_location, parent_commit))
 
     mo.show_code(
         f"Output: Diff contains {sum([len(lines) for lines in affected_lines.values()])} changed lines in {len(affected_lines)} files."
     )
-    return PatchSet, affected_lines, parse_diff
+    return affected_lines, git_diff_lines, parse_diff
 
 
 @app.cell
@@ -426,176 +480,156 @@ def __(example_3, mo):
 
 
 @app.cell
-def __(BaseModel):
-    from lsproxy import FilePosition
+def __(BatchedSourceReader, api_client):
+    from blast_radius import PropagationLimits, PropagationResult
 
-
-    class HierarchyItem(BaseModel):
-        name: str
-        kind: str
-        defined_at: FilePosition
-        source_code: str
-
-        def __hash__(self) -> int:
-            return hash(
-                (
-                    self.defined_at.path,
-                    self.defined_at.position.line,
-                    self.defined_at.position.character,
-                )
-            )
-    return FilePosition, HierarchyItem
+    # Source code is only downloaded when something asks for it, and then for a whole file at once (see Appendix E)
+    source_reader = BatchedSourceReader(api_client)
+    return PropagationLimits, PropagationResult, source_reader
 
 
 @app.cell
-def __(
-    FilePosition,
-    GetReferencesRequest,
-    HierarchyItem,
-    List,
-    Set,
-    Tuple,
-    api_client,
-    mo,
-):
-    def get_symbols_containing_positions(
-        target_positions: List[FilePosition],
-    ) -> List[HierarchyItem]:
-        file_path = target_positions[0].path
-
-        # Get all the definitions in the file
-        symbols = api_client.definitions_in_file(file_path)
-
-        # And save the ones that contain some of our affected lines
-        symbols_containing_position = {
-            HierarchyItem(
-                name=symbol.name,
-                kind=symbol.kind,
-                defined_at=symbol.identifier_position,
-                source_code=api_client.read_source_code(symbol.range).source_code,
-            )
-            for symbol in symbols
-            for target_position in target_positions
-            if symbol.range.contains(target_position)
-        }
-        return symbols_containing_position
-
-
-    def propagate_changes_through_codebase(
-        symbols_changed_directly: List[FilePosition],
-    ):
-        """
-        Compute the chain of code symbols that touch the code at the starting positions.
-        """
-        nodes: Set[HierarchyItem] = set()
-        edges: Set[Tuple[HierarchyItem, HierarchyItem]] = set()
-
-        # Initialize with symbols that contain the starting positions
-        stack = list(symbols_changed_directly)
-
-        while stack:
-            symbol = stack.pop()
+def __(MAX_CONCURRENT_REQUESTS, api_client, mo, source_reader, workspace):
+    import inspect
+    import textwrap
 
-            # If we've already processesed this symbol skip it
-            if symbol in nodes:
-                continue
-            nodes.add(symbol)
+    from blast_radius import BlastRadius, RelatedSymbolsCache
 
-            # For each symbol we find all its references
-            references = api_client.find_references(
-                GetReferencesRequest(
-                    identifier_position=symbol.defined_at,
-                    include_declaration=False,
-                )
-            ).references
-
-            # Group them by file
-            references_by_file = {}
-            for ref in references:
-                references_by_file.setdefault(ref.path, []).append(ref)
-
-            # And then find symbols that contain the references so we can keep processing
-            related_symbols = [
-                sym
-                for refs in references_by_file.values()
-                for sym in get_symbols_containing_positions(refs)
-            ]
-
-            for related_symbol in related_symbols:
-                if related_symbol != symbol:
-                    edges.add((symbol, related_symbol))
-                    stack.append(related_symbol)
-
-        return nodes, edges
+    # The analysis lives in blast_radius.py, so scripts and CI can run it without the notebook
+    blast_radius = BlastRadius(
+        api_client, source_reader=source_reader, max_concurrent_requests=MAX_CONCURRENT_REQUESTS
+    )
+    get_symbols_containing_positions = blast_radius.get_symbols_containing_positions
+    get_symbols_overlapping_lines = blast_radius.get_symbols_overlapping_lines
+    find_related_symbols = blast_radius.find_related_symbols
+    stream_changes_through_codebase = blast_radius.stream_changes_through_codebase
+    propagate_changes_through_codebase = blast_radius.propagate_changes_through_codebase
 
+    # Remember every symbol's related symbols, so when the diff changes only new symbols are looked up,
+    # along with the ones in files that were edited since
+    related_symbols_cache = RelatedSymbolsCache(workspace)
 
-    mo.show_code()
+    mo.vstack(
+        [
+            mo.show_code(),
+            mo.accordion(
+                {
+                    "How BlastRadius finds and follows the symbols": mo.md(
+                        "```python\n"
+                        + "\n".join(
+                            textwrap.dedent(inspect.getsource(method))
+                            for method in (
+                                BlastRadius.get_symbols_overlapping_lines,
+                                BlastRadius.find_related_symbols,
+                                BlastRadius.stream_changes_through_codebase,
+                            )
+                        )
+                        + "```"
+                    )
+                }
+            ),
+        ]
+    )
     return (
+        BlastRadius,
+        RelatedSymbolsCache,
+        blast_radius,
+        find_related_symbols,
         get_symbols_containing_positions,
+        get_symbols_overlapping_lines,
+        inspect,
         propagate_changes_through_codebase,
+        related_symbols_cache,
+        stream_changes_through_codebase,
+        textwrap,
     )
 
 
 @app.cell
-def __(
-    FilePosition,
-    Position,
+async def __(
+    PropagationLimits,
+    PropagationResult,
     affected_lines,
-    api_client,
-    get_symbols_containing_positions,
+    api_metrics,
+    async_api_client,
+    async_iterate,
+    get_symbols_overlapping_lines,
     mo,
-    propagate_changes_through_codebase,
+    propagation_preview,
+    related_symbols_cache,
+    stream_changes_through_codebase,
+    throttle,
 ):
     affected_files = list(affected_lines.keys())
-    with mo.status.spinner():
-        workspace_files = api_client.list_files()
+    with mo.status.spinner(), api_metrics.analysis("example_3"):
+        workspace_files = await async_api_client.list_files()
     affected_code_files = filter(
         lambda file: file in workspace_files, affected_files
     )
 
     symbols_changed_directly = set()
     for file in affected_code_files:
-        # For all the affected lines, we figure out what symbol they belong to
-        affected_positions = [
-            FilePosition(path=file, position=Position(line=line, character=0))
-            for line in affected_lines[file]
-        ]
-        symbols_changed_directly.update(
-            get_symbols_containing_positions(affected_positions)
-        )
+        # For each range of affected lines, we figure out what symbols it falls in
+        with api_metrics.analysis("example_3"):
+            symbols_changed_directly.update(
+                get_symbols_overlapping_lines(file, affected_lines[file].ranges())
+            )
 
-    # And then recursively follow the affected symbol through the codebase by following references
-    all_nodes, all_edges = propagate_changes_through_codebase(
-        symbols_changed_directly
-    )
+    # And then recursively follow the affected symbol through the codebase by following references.
+    # A change to a widely used type can reach most of the codebase, so we put a bound on the search.
+    # Symbols come back as they're found, so we redraw the graph so far every couple of seconds while it runs.
+    # The search runs on a worker thread (see Appendix D for `async_iterate`), so the notebook stays responsive
+    redraw_ex3 = throttle(seconds=2)
+    with api_metrics.analysis("example_3"):
+        async for update in async_iterate(
+            stream_changes_through_codebase(
+                symbols_changed_directly,
+                limits=PropagationLimits(max_nodes=500, time_budget_seconds=300),
+                related_symbols_cache=related_symbols_cache,
+            )
+        ):
+            if redraw_ex3():
+                mo.output.replace(
+                    propagation_preview(update.graph, symbols_changed_directly, affected_lines)
+                )
+    propagation = PropagationResult(update.graph, update.truncated_by)
+    all_nodes = propagation.graph.items
 
     mo.show_code()
     return (
         affected_code_files,
         affected_files,
-        affected_positions,
-        all_edges,
         all_nodes,
         file,
+        propagation,
+        redraw_ex3,
         symbols_changed_directly,
+        update,
         workspace_files,
     )
 
 
 @app.cell
 def __(
-    all_edges,
     all_nodes,
+    hierarchy_to_adjacency,
     hierarchy_to_mermaid,
     mo,
+    needs_clustering,
+    propagation,
     symbols_changed_directly,
 ):
-    mm = hierarchy_to_mermaid(all_nodes, all_edges, symbols_changed_directly)
+    mm = hierarchy_to_mermaid(propagation.graph, symbols_changed_directly)
+    # A big graph is drawn a file or directory per box, so list the symbols themselves in a table underneath
+    graph_clustered = needs_clustering(propagation.graph)
     mo.vstack([
         mo.md("### Call graph of the code affected by the change.\n #### The white nodes are present in the diff, while the red ones are affected indirectly."),
-        mo.mermaid(mm)
+        mo.md(f"_The search stopped early ({', '.join(propagation.truncated_by)}), so this graph is partial._") if propagation.truncated else mo.md(""),
+        mo.md(f"_{len(all_nodes)} symbols are too many to draw one by one, so they're grouped by file or directory. Every symbol is in the table below._") if graph_clustered else mo.md(""),
+        mo.mermaid(mm),
+        mo.ui.table(hierarchy_to_adjacency(propagation.graph), selection=None, page_size=20) if graph_clustered else mo.md(""),
     ])
-    return (mm,)
+    return graph_clustered, mm
 
 
 @app.cell
@@ -619,45 +653,88 @@ def __(affected_lines, all_nodes, mo):
     )
 
 
+@app.cell
+def __(mo, ready_to_summarize):
+    mo.stop(not ready_to_summarize)
+    openai_api_key_input = mo.ui.text("", label="openai api key", kind="password")
+    mo.vstack(
+        [
+            mo.md(
+                "Let's use gpt-4o to summarize how other parts of the codebase are affected by our change."
+            ),
+            openai_api_key_input,
+        ]
+    )
+    return (openai_api_key_input,)
+
+
 @app.cell
 def __(
     affected_files_not_in_diff,
     affected_files_not_in_diff_str,
     all_nodes,
-    diff_text,
+    api_metrics,
+    checkout_location,
+    git_diff_lines,
     mo,
-    ready_to_summarize,
+    openai_api_key_input,
+    parent_commit,
+    source_reader,
 ):
+    # The prompt needs the source of every related file, so it's only put together once there's a key to send it with
+    mo.stop(not openai_api_key_input.value)
     from openai import OpenAI
 
-    mo.stop(not ready_to_summarize)
-    openai_api_key_input = mo.ui.text("", label="openai api key", kind="password")
     system = f"""
     You are a precise and meticulous code reviewer.
     Explain clearly and concisely how the changed code flows
     through the related code in {affected_files_not_in_diff_str}
     """
-    related_code_not_in_the_diff = [
-        f"{n.defined_at.path}\n```\n{n.source_code}\n```"
-        for n in all_nodes
-        if n.defined_at.path in affected_files_not_in_diff
-    ]
+    # Download the source of the related files concurrently, one request per file
+    with api_metrics.analysis("example_3"):
+        source_reader.prefetch(affected_files_not_in_diff)
+        related_code_not_in_the_diff = [
+            f"{n.defined_at.path}\n```\n{n.source_code}\n```"
+            for n in all_nodes
+            if n.defined_at.path in affected_files_not_in_diff
+        ]
     related_code_not_in_the_diff_str = "\n".join(related_code_not_in_the_diff)
 
+    # The model gets the diff itself, so this is the one place we keep all of its text
+    diff_text = "".join(git_diff_lines(checkout_location, parent_commit))
     message = f"# Diff:\n\n ```\n{diff_text}\n``` \n\n# Related code:\n\n{related_code_not_in_the_diff_str}"
+
+    client = OpenAI(api_key=openai_api_key_input.value)
+    with mo.status.spinner():
+        completion = client.chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": system},
+                {
+                    "role": "user",
+                    "content": message,
+                },
+            ],
+        )
     mo.vstack(
         [
-            mo.md(
-                "Let's use gpt-4o to summarize how other parts of the codebase are affected by our change."
+            mo.callout(
+                mo.vstack(
+                    [
+                        mo.md("## AI summary of change blast radius:"),
+                        mo.md(completion.choices[0].message.content),
+                    ]
+                )
             ),
-            openai_api_key_input,
             mo.show_code(),
         ]
     )
     return (
         OpenAI,
+        client,
+        completion,
+        diff_text,
         message,
-        openai_api_key_input,
         related_code_not_in_the_diff,
         related_code_not_in_the_diff_str,
         system,
@@ -665,29 +742,93 @@ def __(
 
 
 @app.cell
-def __(OpenAI, message, mo, openai_api_key_input, system):
-    mo.stop(not openai_api_key_input.value)
-    client = OpenAI(api_key=openai_api_key_input.value)
-    with mo.status.spinner():
-        completion = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system},
-                {
-                    "role": "user",
-                    "content": message,
-                },
-            ],
-        )
-    mo.callout(
-        mo.vstack(
-            [
-                mo.md("## AI summary of change blast radius:"),
-                mo.md(completion.choices[0].message.content),
-            ]
-        )
+def __(mo, ready_to_summarize):
+    mo.stop(not ready_to_summarize)
+    batch_ranges_input = mo.ui.text_area(
+        placeholder="One per line: base..head, base...head, or a single (merge) commit",
+        label="Commit ranges",
+        full_width=True,
+    )
+    batch_report_dir_input = mo.ui.text("blast-radius-reports", label="Write the reports to")
+    batch_run_button = mo.ui.run_button(label="Analyze every range")
+    mo.vstack(
+        [
+            mo.md(
+                """### Batch mode: the blast radius of many changes at once.\n The same analysis works for every PR merged in a release window. Each range gets its own diff and propagation, but they share the caches, so a symbol that several of them reach is only looked up once. lsproxy answers from the checkout as it is now, so a range is only analyzed if the files it changes are the same in the checkout as at its head."""
+            ),
+            batch_ranges_input,
+            batch_report_dir_input,
+            batch_run_button,
+        ]
     )
-    return client, completion
+    return batch_ranges_input, batch_report_dir_input, batch_run_button
+
+
+@app.cell
+def __(PropagationLimits, blast_radius, checkout_location, mo, related_symbols_cache):
+    from blast_radius import blast_radius_report, write_blast_radius_report
+
+
+    def analyze_commit_ranges(commit_ranges, report_dir, limits=PropagationLimits()):
+        """
+        Analyze every range in `commit_ranges`, a few at a time, writing a report for each.
+        Yields (index into commit_ranges, summary row) as each one finishes.
+        """
+        # Shared with Example 3 and between the ranges, so each symbol's references are only looked up once
+        for index, analysis in blast_radius.analyze_commit_ranges(
+            checkout_location, commit_ranges, limits=limits, related_symbols_cache=related_symbols_cache
+        ):
+            report = blast_radius_report(analysis)
+            yield index, {
+                "range": analysis.commit_range,
+                "files changed": len(analysis.changed_lines),
+                "symbols changed directly": len(analysis.changed_directly),
+                "symbols affected": len(report["symbols"]),
+                "files affected": len(report["files_affected"]),
+                "truncated by": ", ".join(analysis.propagation.truncated_by),
+                "report": write_blast_radius_report(report_dir, analysis, report),
+            }
+
+
+    mo.show_code()
+    return analyze_commit_ranges, blast_radius_report, write_blast_radius_report
+
+
+@app.cell
+def __(
+    PropagationLimits,
+    analyze_commit_ranges,
+    api_metrics,
+    batch_ranges_input,
+    batch_report_dir_input,
+    batch_run_button,
+    mo,
+):
+    mo.stop(not batch_run_button.value)
+    commit_ranges = [line.strip() for line in batch_ranges_input.value.splitlines() if line.strip()]
+    batch_rows = [None] * len(commit_ranges)
+    batch_error = None
+    with api_metrics.analysis("batch"), mo.status.progress_bar(
+        total=len(commit_ranges), title="Ranges analyzed", remove_on_exit=True
+    ) as batch_progress:
+        try:
+            for _index, _row in analyze_commit_ranges(
+                commit_ranges,
+                batch_report_dir_input.value,
+                limits=PropagationLimits(max_nodes=500, time_budget_seconds=300),
+            ):
+                batch_rows[_index] = _row
+                batch_progress.update()
+        except ValueError as error:
+            # Every range is checked before any is analyzed, so this is usually one that can't be
+            batch_error = str(error)
+    mo.vstack(
+        [
+            mo.callout(mo.md(batch_error), kind="danger") if batch_error else mo.md(""),
+            mo.ui.table([row for row in batch_rows if row is not None], selection=None),
+        ]
+    )
+    return batch_error, batch_progress, batch_rows, commit_ranges
 
 
 @app.cell
@@ -706,8 +847,8 @@ def __():
 def __(create_dropdowns, create_selector_dict, mo):
     # UI Elements for the first example
     js_dropdown_1, rs_dropdown_1 = create_dropdowns(
-        "server/src/handlers/chunk_handler.rs: (65 symbols)",
-        "frontends/search/src/hooks/useSearch.ts: (16 symbols)",
+        "server/src/handlers/chunk_handler.rs",
+        "frontends/search/src/hooks/useSearch.ts",
     )
     selector_dict_1 = create_selector_dict(js_dropdown_1, rs_dropdown_1)
     code_language_select_ex1 = mo.ui.radio(
@@ -737,8 +878,8 @@ def __(code_language_select_ex1, mo, selector_dict_1):
 def __(create_dropdowns, create_selector_dict, mo):
     # UI Elements for the second example
     js_dropdown_2, rs_dropdown_2 = create_dropdowns(
-        "server/src/handlers/analytics_handler.rs: (15 symbols)",
-        "frontends/search/src/hooks/useSearch.ts: (16 symbols)",
+        "server/src/handlers/analytics_handler.rs",
+        "frontends/search/src/hooks/useSearch.ts",
     )
     selector_dict_2 = create_selector_dict(js_dropdown_2, rs_dropdown_2)
     submit_button_2 = mo.ui.run_button(label="Find referenced files")
@@ -776,11 +917,47 @@ def __():
 
 
 @app.cell
-def __(create_lang_dropdown, json):
+def __(load_file_symbol_counts, mo, workspace):
+    # The files to choose from and how many symbols they have, counted by workspace_index.py with lsproxy
+    initial_file_symbol_counts, file_symbol_counts_current = load_file_symbol_counts(workspace)
+    get_file_symbol_counts, set_file_symbol_counts = mo.state(initial_file_symbol_counts)
+    # Until the indexer has counted the symbols in this version of the workspace, look for its table again
+    file_symbol_counts_refresh = (
+        None if file_symbol_counts_current else mo.ui.refresh(default_interval="5s")
+    )
+    file_symbol_counts_refresh
+    return (
+        file_symbol_counts_current,
+        file_symbol_counts_refresh,
+        get_file_symbol_counts,
+        initial_file_symbol_counts,
+        set_file_symbol_counts,
+    )
+
+
+@app.cell
+def __(
+    file_symbol_counts_refresh,
+    get_file_symbol_counts,
+    load_file_symbol_counts,
+    set_file_symbol_counts,
+    workspace,
+):
+    file_symbol_counts_refresh
+    if file_symbol_counts_refresh is not None:
+        _counts, _current = load_file_symbol_counts(workspace)
+        # Rebuilding the dropdowns resets them, so only do it once the table has changed
+        if _current and _counts != get_file_symbol_counts():
+            set_file_symbol_counts(_counts)
+    return
+
+
+@app.cell
+def __(create_lang_dropdown, get_file_symbol_counts):
+    file_with_symbol_count = get_file_symbol_counts()
+
+
     def create_dropdowns(rust_value, js_value):
-        # This json was created with lsproxy via list_files and definitions_in_file.
-        with open("file_options.json", "r") as f:
-            file_with_symbol_count = json.load(f)
         js_dropdown = create_lang_dropdown(
             file_with_symbol_count,
             ["ts", "tsx", "js", "jsx"],
@@ -791,7 +968,7 @@ def __(create_lang_dropdown, json):
             file_with_symbol_count, ["rs"], "Select a rust file ->", rust_value
         )
         return js_dropdown, rs_dropdown
-    return (create_dropdowns,)
+    return create_dropdowns, file_with_symbol_count
 
 
 @app.cell
@@ -802,6 +979,10 @@ def __(mo):
             for file, symbols in file_symbol_dict
             if file.split(".")[-1] in endings
         }
+        # The value is given as a file, find its option (if the file is still there)
+        value = next(
+            (option for option, file in file_options.items() if file == value), None
+        )
         return mo.ui.dropdown(options=file_options, label=label, value=value)
     return (create_lang_dropdown,)
 
@@ -875,188 +1056,353 @@ def __():
 
 @app.cell
 def __():
-    def generate_reference_diagram(dependencies: dict, max_chars: int = 28) -> str:
+    # Diagrams are drawn by blast_radius.py, so they look the same from the command line.
+    # Past a few hundred boxes mermaid takes seconds to lay a diagram out, so bigger graphs get collapsed
+    from blast_radius import (
+        generate_reference_diagram,
+        hierarchy_to_adjacency,
+        hierarchy_to_mermaid,
+        needs_clustering,
+    )
+    return (
+        generate_reference_diagram,
+        hierarchy_to_adjacency,
+        hierarchy_to_mermaid,
+        needs_clustering,
+    )
+
+
+@app.cell
+def __(hierarchy_to_mermaid, mo):
+    def propagation_preview(graph, symbols_changed_directly, affected_lines):
         """
-        Convert a dictionary of file dependencies and their referenced symbols into a Mermaid diagram string.
-        Arrows point from referenced file back to source file through reference nodes.
-        Args:
-            dependencies: Dict where keys are tuples of (defined_file, referenced_file) and values are sets of referenced symbols
-                         OR a string representing the root file path when there are no dependencies
-            max_chars: Maximum length for displayed file paths, truncating from left if needed
-        Returns:
-            String containing the Mermaid diagram definition
+        Show the part of Example 3's call graph found so far, and the files outside the diff it reaches,
+        while the search is still running.
         """
-
-        def get_display_name(file_path: str) -> str:
-            """Get display name for a file, truncating from left if needed."""
-            if len(file_path) <= max_chars:
-                return file_path
-            return "..." + file_path[-(max_chars - 3) :]
-
-        # Handle case where dependencies is just a root file string
-        if isinstance(dependencies, str):
-            return f"""graph LR
-        root["{dependencies}"]
-        classDef default fill:#f9f9f9,stroke:#333,stroke-width:2px,color:#000;
-        classDef source fill:#e1f5fe,stroke:#0277bd,stroke-width:2px,color:#000;
-        class root source;"""
-
-        if not dependencies:
-            return "graph LR\n    %% No dependencies to display"
-
-        mermaid_lines = ["graph LR"]
-        # Add styling with reduced padding
-        mermaid_lines.extend(
+        files_not_in_diff = sorted(
+            {node.defined_at.path for node in graph.items} - set(affected_lines.keys())
+        )
+        return mo.vstack(
             [
-                "    %% Styling",
-                "    classDef default fill:#f9f9f9,stroke:#333,stroke-width:2px,color:#000,max-width:none,text-overflow:clip,padding:0px;",
-                "    classDef source fill:#e1f5fe,stroke:#0277bd,stroke-width:2px,color:#000,max-width:none,text-overflow:clip,padding:0px;",
-                "    classDef reference fill:#e8e7ff,stroke:#6b69d6,stroke-width:2px,color:#000,max-width:none,text-overflow:clip,padding:0px;",
+                mo.md(
+                    f"_Searching... found {len(graph)} symbols so far, in {len(files_not_in_diff)} files that are not in the diff._"
+                ),
+                mo.mermaid(hierarchy_to_mermaid(graph, symbols_changed_directly)),
+                mo.md("\n".join(f"{i+1}. {f}" for i, f in enumerate(files_not_in_diff))),
             ]
         )
+    return (propagation_preview,)
 
-        # Collect all unique files and create nodes
-        unique_files = set()
-        for defined_file, referenced_file in dependencies.keys():
-            unique_files.add(defined_file)
-            unique_files.add(referenced_file)
-
-        # Create nodes for each unique file
-        node_names = {}
-        for idx, file in enumerate(unique_files):
-            node_name = f"n{idx}"
-            node_names[file] = node_name
-            display_name = get_display_name(file)
-            clean_name = display_name.replace('"', "&quot;")
-            mermaid_lines.append(f'    {node_name}["{clean_name}"]')
-
-        # Create reference nodes and connections
-        for idx, ((defined_file, referenced_file), symbols) in enumerate(
-            dependencies.items()
-        ):
-            from_node = node_names[defined_file]
-            to_node = node_names[referenced_file]
-            ref_node = f"ref{idx}"
-
-            # Clean and truncate symbols
-            cleaned_symbols = []
-            for symbol in sorted(symbols):
-                clean_symbol = str(symbol)
-                clean_symbol = clean_symbol.replace('"', "&quot;")
-                clean_symbol = clean_symbol.replace("<", "&lt;")
-                clean_symbol = clean_symbol.replace(">", "&gt;")
-                if len(clean_symbol) > 20:
-                    clean_symbol = clean_symbol[:17] + "..."
-                cleaned_symbols.append(clean_symbol)
-
-            # Create symbol display with limited number of examples
-            symbols_display = "<br/>" + "<br/>".join(cleaned_symbols)
-            if len(cleaned_symbols) > 5:
-                symbols_display = (
-                    "<br/>" + "<br/>".join(cleaned_symbols[:5]) + "<br/>..."
-                )
 
-            # Add reference node and connections
-            ref_node_def = (
-                f'    {ref_node}["{len(symbols)} refs{symbols_display}"]'
-            )
-            mermaid_lines.append(ref_node_def)
-            mermaid_lines.append(f"    {to_node} --> {ref_node} --> {from_node}")
-            mermaid_lines.append(f"    class {ref_node} reference")
+@app.cell
+def __():
+    # Appendix D: Helpers for sending lsproxy requests concurrently
+    return
 
-        mermaid_lines.extend(
-            [
-                f"    class {node_names[next(iter(dependencies))[0]]} source;",
-            ]
-        )
 
-        return "\n".join(mermaid_lines)
-    return (generate_reference_diagram,)
+@app.cell
+def __():
+    # Sends calls from a bounded thread pool, so lsproxy sees a steady number of requests (see lsproxy_transport.py)
+    from lsproxy_transport import fan_out
+
+    # lsproxy's client keeps 20 keep-alive connections, so stay under that by default
+    from blast_radius import MAX_CONCURRENT_REQUESTS
+    return MAX_CONCURRENT_REQUESTS, fan_out
 
 
 @app.cell
-def __(HierarchyItem, Set, Tuple):
-    def hierarchy_to_mermaid(
-        nodes: Set[HierarchyItem],
-        edges: Set[Tuple[HierarchyItem, HierarchyItem]],
-        symbols_changed_directly: Set[HierarchyItem],
-    ) -> str:
+def __(MAX_CONCURRENT_REQUESTS, api_client):
+    import asyncio
+    import contextvars
+    from concurrent.futures import ThreadPoolExecutor
+
+    from lsproxy_transport import AsyncLsproxy
+
+    # The same client, but its calls can be awaited so cells don't block on each request in turn
+    async_api_client = AsyncLsproxy(api_client, max_concurrency=MAX_CONCURRENT_REQUESTS)
+
+
+    async def async_fan_out(fn, items):
+        """
+        Await `fn` on every item concurrently and yield `(index, result)` pairs as they complete.
+
+        This is `fan_out` for coroutines: how many run at once is up to the client they call, and
+        anything still running when the caller stops iterating (e.g. interrupting the cell) is cancelled.
         """
-        Convert hierarchy nodes and edges to a Mermaid diagram string with subgraphs by file.
-        Uses hash codes as node identifiers. Nodes that were changed directly are colored red.
 
-        Args:
-            nodes: Set of HierarchyItem objects representing code symbols
-            edges: Set of tuples containing (from_symbol, to_symbol) relationships
-            symbols_changed_directly: Set of HierarchyItem objects that were changed directly
+        async def run(index, item):
+            return index, await fn(item)
 
-        Returns:
-            str: Mermaid diagram representation of the hierarchy with file-based subgraphs
+        tasks = [asyncio.ensure_future(run(index, item)) for index, item in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+    async def async_iterate(generator):
         """
-        mermaid_lines = [
-            "%%{",
-            "  init: {",
-            "    'flowchart': {",
-            "      'rankSpacing': 100,",  # Increase vertical space between ranks
-            "      'nodeSpacing': 50,",  # Increase horizontal space between nodes
-            "      'padding': 20",  # Add padding around the entire diagram
-            "    }",
-            "  }",
-            "}%%",
-            "graph TD",
-        ]
+        Yield what a blocking generator yields, stepping it on a worker thread so the cell awaits each item.
 
-        # Track nodes that need red styling
-        direct_node_ids = set()
-        indirect_node_ids = set()
-
-        # Group nodes by file
-        nodes_by_file = {}
-        for node in nodes:
-            file_path = node.defined_at.path
-            if file_path not in nodes_by_file:
-                nodes_by_file[file_path] = []
-            nodes_by_file[file_path].append(node)
-
-            # Track node IDs that need to be colored red
-            if node in symbols_changed_directly:
-                direct_node_ids.add(f"node{abs(hash(node))}")
+        Each step runs in a copy of the caller's context, so context variables (e.g. metrics tags) carry
+        over. When the caller stops iterating (e.g. interrupting the cell) the generator is closed as
+        soon as the step it's in finishes.
+        """
+        executor = ThreadPoolExecutor(max_workers=1)
+        finished = object()
+        step = None
+        try:
+            while True:
+                step = executor.submit(contextvars.copy_context().run, next, generator, finished)
+                item = await asyncio.wrap_future(step)
+                if item is finished:
+                    return
+                yield item
+        finally:
+            if step is None or step.done():
+                generator.close()
             else:
-                indirect_node_ids.add(f"node{abs(hash(node))}")
-
-        # Create subgraphs for each file
-        for file_idx, (file_path, file_nodes) in enumerate(nodes_by_file.items()):
-            # Create subgraph with unique ID
-            subgraph_id = f"subgraph_{file_idx}"
-            mermaid_lines.append(f"    subgraph {subgraph_id}[{file_path}]")
-
-            # Add nodes for this file
-            for node in file_nodes:
-                # Escape quotes and special characters in names
-                escaped_name = node.name.replace('"', '\\"')
-                # Add kind as a suffix in italics
-                label = f'"{escaped_name}<br><i>{node.kind}</i>"'
-                # Use absolute value of hash to ensure positive ID
-                node_id = f"node{abs(hash(node))}"
-                mermaid_lines.append(f"        {node_id}[{label}]")
-
-            # Close subgraph
-            mermaid_lines.append("    end")
-
-        # Add edges using hash IDs (outside subgraphs)
-        for from_node, to_node in edges:
-            from_id = f"node{abs(hash(from_node))}"
-            to_id = f"node{abs(hash(to_node))}"
-            mermaid_lines.append(f"    {from_id} --> {to_id}")
-
-        # Add styling for red nodes
-        for node_id in indirect_node_ids:
-            mermaid_lines.append(f"    style {node_id} fill:#ffcccc,color:#000")
-        for node_id in direct_node_ids:
-            mermaid_lines.append(f"    style {node_id} fill:#ffffff,color:#000")
-
-        return "\n".join(mermaid_lines)
-    return (hierarchy_to_mermaid,)
+                step.add_done_callback(lambda _: generator.close())
+            executor.shutdown(wait=False)
+    return (
+        AsyncLsproxy,
+        ThreadPoolExecutor,
+        async_api_client,
+        async_fan_out,
+        async_iterate,
+        asyncio,
+        contextvars,
+    )
+
+
+@app.cell
+def __():
+    from time import monotonic
+
+
+    def throttle(seconds):
+        """
+        Make a function that returns True at most once every `seconds`.
+
+        Crawls check it after each result to decide whether to redraw what they've found so far,
+        so the output keeps up without redrawing on every single request.
+        """
+        last_true = [float("-inf")]
+
+        def ready():
+            now = monotonic()
+            if now - last_true[0] < seconds:
+                return False
+            last_true[0] = now
+            return True
+
+        return ready
+    return monotonic, throttle
+
+
+@app.cell
+def __():
+    # Appendix E: Caching lsproxy results
+    return
+
+
+@app.cell
+def __(json):
+    from workspace_index import (
+        as_file_options,
+        default_cache_dir,
+        file_options_path,
+        latest_file_options,
+        load_file_options,
+    )
+
+
+    def load_file_symbol_counts(workspace=None):
+        """
+        Get the [(file, symbol count)] list for the file dropdowns without waiting on lsproxy, and whether
+        it's for the current version of the `workspace`.
+
+        `workspace_index.py` counts the symbols at startup. Until its table for the current version
+        is written we use the most recent one, or the file_options.json that ships with the tutorial.
+        """
+        version = workspace.version if workspace is not None else None
+        if version is not None:
+            counts = load_file_options(file_options_path(default_cache_dir(), version))
+            if counts is not None:
+                return as_file_options(counts), True
+            previous = latest_file_options(default_cache_dir())
+            if previous is not None:
+                return as_file_options(previous), False
+        with open("file_options.json", "r") as f:
+            return json.load(f), version is None
+    return (
+        as_file_options,
+        default_cache_dir,
+        file_options_path,
+        latest_file_options,
+        load_file_options,
+        load_file_symbol_counts,
+    )
+
+
+@app.cell
+def __():
+    # The caches from lsproxy_cache.py, stacked in front of the HTTP client, with metrics and recording if asked for
+    from lsproxy_cache import wrap_client
+    return (wrap_client,)
+
+
+@app.cell
+def __(PooledLsproxy, api_client, mo):
+    # What api_client is made of, outermost first: each layer answers what it can and passes the rest on.
+    # MeteredClients only count the calls that reach the layer they wrap, so they're left out
+    _layers, _layer = [], api_client
+    while _layer is not None and not isinstance(_layer, PooledLsproxy):
+        if type(_layer).__name__ != "MeteredClient":
+            _layers.append(type(_layer).__name__)
+        _layer = getattr(_layer, "_client", None)
+    if _layer is not None:
+        _layers.append(type(_layer).__name__)
+    mo.md("`api_client` is " + " → ".join(f"`{_name}`" for _name in _layers))
+    return
+
+
+@app.cell
+def __(FileRange, Position, fan_out):
+    import threading
+
+
+    class BatchedSourceReader:
+        """
+        Read the source code of symbol ranges lazily, with one lsproxy request per file.
+
+        Ranges are `register`ed up front without any requests. The first `read` in a file fetches a single
+        span covering every range registered there, and all of them are then sliced out of it locally.
+        """
+
+        def __init__(self, client):
+            self._client = client
+            self._lock = threading.Lock()
+            # file_path -> [first line, end position] covering every registered range
+            self._spans = {}
+            # file_path -> (first line, end position, lines of source) that was read
+            self._sources = {}
+
+        @staticmethod
+        def _key(position):
+            return (position.line, position.character)
+
+        def register(self, file_range):
+            """Note that the source for `file_range` may be read later."""
+            with self._lock:
+                span = self._spans.get(file_range.path)
+                if span is None:
+                    self._spans[file_range.path] = [file_range.start.line, self._key(file_range.end)]
+                    return
+                span[0] = min(span[0], file_range.start.line)
+                span[1] = max(span[1], self._key(file_range.end))
+
+        def _covers(self, source, file_range):
+            first_line, end, _ = source
+            return first_line <= file_range.start.line and self._key(file_range.end) <= end
+
+        def _load(self, file_path):
+            with self._lock:
+                first_line, end = self._spans[file_path]
+            # Start at the beginning of the line so slicing never has to account for a partial first line
+            span = FileRange(
+                path=file_path,
+                start=Position(line=first_line, character=0),
+                end=Position(line=end[0], character=end[1]),
+            )
+            lines = self._client.read_source_code(span).source_code.split("\n")
+            with self._lock:
+                self._sources[file_path] = (first_line, end, lines)
+                return self._sources[file_path]
+
+        def read(self, file_range):
+            """Get the source code for `file_range`, reading its file from lsproxy if needed."""
+            self.register(file_range)
+            with self._lock:
+                source = self._sources.get(file_range.path)
+            if source is None or not self._covers(source, file_range):
+                source = self._load(file_range.path)
+            first_line, _, lines = source
+            selected = lines[file_range.start.line - first_line : file_range.end.line - first_line + 1]
+            if len(selected) == 1:
+                return selected[0][file_range.start.character : file_range.end.character]
+            return "\n".join(
+                [selected[0][file_range.start.character :]]
+                + selected[1:-1]
+                + [selected[-1][: file_range.end.character]]
+            )
+
+        def prefetch(self, file_paths):
+            """Read every registered range in `file_paths` with concurrent requests."""
+            with self._lock:
+                to_load = [path for path in file_paths if path in self._spans and path not in self._sources]
+            for _ in fan_out(self._load, to_load):
+                pass
+    return BatchedSourceReader, threading
+
+
+@app.cell
+def __():
+    # Appendix F: Finding the symbols that contain a position
+    return
+
+
+@app.cell
+def __():
+    # An interval tree over the ranges of the symbols in a file, in flat arrays (see blast_radius.py)
+    from blast_radius import SymbolIndex
+    return (SymbolIndex,)
+
+
+@app.cell
+def __():
+    # Appendix G: What the tutorial asked lsproxy, and how much of it the caches answered
+    return
+
+
+@app.cell
+def __(mo):
+    # Counting is cheap, so it's always on. Refresh to see calls from examples that are still running
+    metrics_refresh = mo.ui.refresh(options=["2s", "10s"], default_interval="10s")
+    metrics_refresh
+    return (metrics_refresh,)
+
+
+@app.cell
+def __(api_metrics, metrics_refresh, mo):
+    metrics_refresh
+    # Each row is one kind of call from one example. "into X" counts the calls that got as far as layer X,
+    # from the outside in, so the drop from one column to the next is what that cache answered
+    mo.vstack(
+        [
+            mo.ui.table(api_metrics.summary(), selection=None, page_size=20),
+            mo.hstack(
+                [
+                    mo.download(
+                        api_metrics.to_prometheus().encode("utf-8"),
+                        filename="lsproxy_metrics.prom",
+                        mimetype="text/plain",
+                        label="Prometheus metrics",
+                    ),
+                    mo.download(
+                        api_metrics.to_json().encode("utf-8"),
+                        filename="lsproxy_metrics.json",
+                        mimetype="application/json",
+                        label="JSON",
+                    ),
+                ],
+                justify="start",
+            ),
+        ]
+    )
+    return
 
 
 if __name__ == "__main__":
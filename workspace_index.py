@@ -0,0 +1,575 @@
+"""
+Index every symbol in the lsproxy workspace, and the references to each of them.
+
+start.sh runs this in the background once lsproxy is up. The tutorial answers symbol and reference
+lookups from the index when it's there, instead of going out to the language servers every time.
+It also writes the file -> symbol count table that fills the tutorial's file dropdowns, and the
+reverse call graph Example 3 follows changes through.
+
+    python workspace_index.py --base-url http://localhost:4444/v1 --workspace /mnt/workspace
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from lsproxy import FilePosition, GetReferencesRequest, Symbol
+
+from lsproxy_transport import PooledLsproxy
+
+
+def workspace_version(workspace_root: str) -> Optional[str]:
+    """
+    Identify the state of a git checkout: its HEAD commit, plus a hash of any uncommitted changes,
+    including new files git doesn't track yet. Returns None if `workspace_root` isn't a git checkout.
+    """
+    try:
+        head = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=workspace_root, stderr=subprocess.DEVNULL
+        ).decode("utf-8").strip()
+        uncommitted = subprocess.check_output(
+            ["git", "diff", "HEAD"], cwd=workspace_root, stderr=subprocess.DEVNULL
+        )
+        untracked = subprocess.check_output(
+            ["git", "ls-files", "--others", "--exclude-standard", "-z"],
+            cwd=workspace_root,
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    if untracked:
+        # Untracked files aren't in the diff, so their names and modification times stand in for them
+        for file in untracked.decode("utf-8", errors="replace").split("\0"):
+            if file:
+                uncommitted += f"\0{file}\0{_modified_time(workspace_root, file)}".encode("utf-8")
+    if uncommitted:
+        return f"{head}+{hashlib.sha1(uncommitted).hexdigest()}"
+    return head
+
+
+class Workspace:
+    """
+    A git checkout lsproxy is serving, which may be edited while the tutorial runs.
+
+    `version` is its `workspace_version`, worked out again when it's asked for once `recheck_seconds`
+    have passed, so caches keyed by it follow edits without running git on every lookup.
+    `file_version` identifies one file by its modification time and size, which only takes a stat, so
+    caches of answers about a single file can check it every time.
+    """
+
+    def __init__(self, root: str, recheck_seconds: float = 2.0):
+        self.root = root
+        self._recheck_seconds = recheck_seconds
+        self._lock = threading.Lock()
+        self._version = workspace_version(root)
+        self._checked = time.monotonic()
+        self._rechecking = False
+
+    @property
+    def version(self) -> Optional[str]:
+        with self._lock:
+            if self._rechecking or time.monotonic() - self._checked < self._recheck_seconds:
+                return self._version
+            # Other threads keep getting the last version while this one asks git
+            self._rechecking = True
+        try:
+            version = workspace_version(self.root)
+        finally:
+            with self._lock:
+                self._rechecking = False
+        with self._lock:
+            self._version, self._checked = version, time.monotonic()
+        return version
+
+    def modified_time(self, file_path: str) -> Optional[int]:
+        return _modified_time(self.root, file_path)
+
+    def file_version(self, file_path: str) -> Optional[str]:
+        """The file's modification time and size, or None if it doesn't exist."""
+        try:
+            stat = os.stat(os.path.join(self.root, file_path))
+        except OSError:
+            return None
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def default_cache_dir() -> str:
+    """Where the tutorial keeps everything it caches between runs."""
+    return os.environ.get(
+        "LSPROXY_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "lsproxy-tutorial")
+    )
+
+
+def index_path(cache_dir: str, version: str) -> str:
+    """Where the index for a given workspace version is stored."""
+    return os.path.join(cache_dir, f"index-{version}.json.gz")
+
+
+def call_graph_path(cache_dir: str, version: str) -> str:
+    """Where the reverse call graph for a given workspace version is stored."""
+    return os.path.join(cache_dir, f"callgraph-{version}.json.gz")
+
+
+def file_options_path(cache_dir: str, version: str) -> str:
+    """Where the file -> symbol count table for a given workspace version is stored."""
+    return os.path.join(cache_dir, f"file_options-{version}.json")
+
+
+def _modified_time(workspace_root: Optional[str], file_path: str) -> Optional[int]:
+    if workspace_root is None:
+        return None
+    try:
+        return os.stat(os.path.join(workspace_root, file_path)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _is_current(modified_times: Dict[str, Optional[int]], file_path: str, workspace: Workspace) -> bool:
+    modified_time = modified_times.get(file_path)
+    return modified_time is not None and modified_time == workspace.modified_time(file_path)
+
+
+def count_symbols(
+    symbols_by_file: Dict[str, List[Symbol]], modified_times: Dict[str, Optional[int]]
+) -> Dict[str, Tuple[Optional[int], int]]:
+    """
+    Count the symbols defined in every file, from the definitions `WorkspaceIndex.build` fetched.
+
+    Returns file -> (modification time, symbol count), the table `save_file_options` writes.
+    """
+    return {file: (modified_times.get(file), len(symbols)) for file, symbols in symbols_by_file.items()}
+
+
+def save_file_options(path: str, counts: Dict[str, Tuple[Optional[int], int]]):
+    """Write a table from `count_symbols`, replacing it atomically."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    partial_path = f"{path}.partial"
+    with open(partial_path, "w") as f:
+        json.dump(counts, f)
+    os.replace(partial_path, path)
+
+
+def load_file_options(path: str) -> Optional[Dict[str, Tuple[Optional[int], int]]]:
+    """Read a table written by `save_file_options`, or None if there isn't one."""
+    try:
+        with open(path) as f:
+            return {file: tuple(entry) for file, entry in json.load(f).items()}
+    except (OSError, ValueError):
+        return None
+
+
+def latest_file_options(cache_dir: str) -> Optional[Dict[str, Tuple[Optional[int], int]]]:
+    """The most recently written symbol count table for any version of the workspace."""
+    try:
+        paths = [
+            os.path.join(cache_dir, name)
+            for name in os.listdir(cache_dir)
+            if name.startswith("file_options-") and name.endswith(".json")
+        ]
+    except OSError:
+        return None
+    if not paths:
+        return None
+    return load_file_options(max(paths, key=os.path.getmtime))
+
+
+def as_file_options(counts: Dict[str, Tuple[Optional[int], int]]) -> List[Tuple[str, int]]:
+    """Turn a symbol count table into the [(file, symbol count)] list of file_options.json, most symbols first."""
+    return sorted(
+        ((file, count) for file, (_, count) in counts.items() if count),
+        key=lambda file_count: -file_count[1],
+    )
+
+
+class WorkspaceIndex:
+    """
+    Symbol table for a whole workspace.
+
+    Holds the symbols defined in every file, the symbols with each name, and the references to every
+    symbol (without the declaration itself, like `find_references` returns by default).
+    It also records when each file was last modified before it was crawled, so answers about files
+    edited since can be told apart (see `is_current`).
+    """
+
+    def __init__(
+        self,
+        files: List[str],
+        symbols_by_file: Dict[str, List[Symbol]],
+        references: Dict[Tuple[str, int, int], List[FilePosition]],
+        modified_times: Optional[Dict[str, Optional[int]]] = None,
+    ):
+        self.files = files
+        self.symbols_by_file = symbols_by_file
+        # (path, line, character) of a symbol's identifier -> positions that reference it
+        self.references = references
+        self.modified_times = modified_times or {}
+        self.symbols_by_name: Dict[str, List[Symbol]] = {}
+        for symbols in symbols_by_file.values():
+            for symbol in symbols:
+                self.symbols_by_name.setdefault(symbol.name, []).append(symbol)
+
+    def definitions(self, name: str) -> List[Symbol]:
+        """All the symbols called `name`."""
+        return self.symbols_by_name.get(name, [])
+
+    def references_to(self, identifier_position: FilePosition) -> Optional[List[FilePosition]]:
+        """The references to the symbol defined at `identifier_position`, or None if it isn't indexed."""
+        return self.references.get(identifier_position.as_tuple)
+
+    def is_current(self, file_path: str, workspace: "Workspace") -> bool:
+        """Whether `file_path` is unchanged in `workspace` since it was indexed."""
+        return _is_current(self.modified_times, file_path, workspace)
+
+    @classmethod
+    def build(
+        cls,
+        client,
+        workspace_root: Optional[str] = None,
+        max_workers: int = 16,
+        log=None,
+        on_symbols: Optional[Callable[[Dict[str, List[Symbol]], Dict[str, Optional[int]]], None]] = None,
+    ) -> "WorkspaceIndex":
+        """
+        Crawl the workspace through an lsproxy client.
+
+        Every file's definitions are requested in parallel, then the references to every symbol.
+        The modification times of the files under `workspace_root` are taken first, so a file edited
+        during the crawl doesn't count as current. `on_symbols` is called with file -> symbols and
+        file -> modification time as soon as the definitions are in, before the much longer reference crawl.
+        """
+        log = log or (lambda message: None)
+        files = client.list_files()
+        modified_times = {file: _modified_time(workspace_root, file) for file in files}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            symbols_by_file = dict(zip(files, executor.map(client.definitions_in_file, files)))
+            symbols = [symbol for file_symbols in symbols_by_file.values() for symbol in file_symbols]
+            log(f"Found {len(symbols)} symbols in {len(files)} files")
+            if on_symbols is not None:
+                on_symbols(symbols_by_file, modified_times)
+
+            def find_references(symbol):
+                return client.find_references(
+                    GetReferencesRequest(identifier_position=symbol.identifier_position)
+                ).references
+
+            references = {}
+            for done, (symbol, refs) in enumerate(
+                zip(symbols, executor.map(find_references, symbols)), start=1
+            ):
+                references[symbol.identifier_position.as_tuple] = refs
+                if done % 500 == 0:
+                    log(f"Found references for {done}/{len(symbols)} symbols")
+        return cls(files, symbols_by_file, references, modified_times)
+
+    def save(self, path: str):
+        """Write the index to a gzipped JSON file, replacing it atomically."""
+        data = {
+            "files": self.files,
+            "symbols_by_file": {
+                file: [symbol.model_dump() for symbol in symbols]
+                for file, symbols in self.symbols_by_file.items()
+            },
+            "references": [
+                [list(key), [ref.as_tuple for ref in refs]] for key, refs in self.references.items()
+            ],
+            "modified_times": self.modified_times,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        partial_path = f"{path}.partial"
+        with gzip.open(partial_path, "wt", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(partial_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "WorkspaceIndex":
+        """Read an index written by `save`."""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+
+        def file_position(path, line, character):
+            return FilePosition.model_validate(
+                {"path": path, "position": {"line": line, "character": character}}
+            )
+
+        return cls(
+            data["files"],
+            {
+                file: [Symbol.model_validate(symbol) for symbol in symbols]
+                for file, symbols in data["symbols_by_file"].items()
+            },
+            {
+                tuple(key): [file_position(*ref) for ref in refs]
+                for key, refs in data["references"]
+            },
+            # Indexes written before modification times were recorded have none, so no file is current
+            data.get("modified_times"),
+        )
+
+
+class ReverseCallGraph:
+    """
+    Which symbols depend on which, for a whole workspace.
+
+    A symbol's dependents are the symbols whose code contains a reference to it, the same thing the
+    tutorial's Example 3 finds by calling `find_references` at every hop. Symbols are identified like
+    the tutorial's `HierarchyItem`, by the (path, line, character) of their identifier. The graph is
+    stored as compressed sparse rows of integer IDs, so following a change through it is a local
+    lookup per symbol instead of a request. `BlastRadius` does those lookups level by level in its
+    usual search rather than walking the graph on its own, so `PropagationLimits` and streamed
+    updates work the same whether a symbol's dependents come from here or from lsproxy.
+    """
+
+    def __init__(
+        self,
+        symbols: List[Tuple],
+        offsets: List[int],
+        targets: List[int],
+        modified_times: Optional[Dict[str, Optional[int]]] = None,
+    ):
+        # (path, line, character, name, kind, start line, start character, end line, end character)
+        # for each symbol, the first three being its key
+        self.symbols = symbols
+        # The dependents of symbol i are targets[offsets[i]:offsets[i + 1]]
+        self.offsets = array("l", offsets)
+        self.targets = array("l", targets)
+        self.ids = {tuple(record[:3]): node_id for node_id, record in enumerate(symbols)}
+        # Those of the index the graph was built from
+        self.modified_times = modified_times or {}
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, key: Tuple[str, int, int]):
+        return key in self.ids
+
+    def symbol(self, key: Tuple[str, int, int]) -> Symbol:
+        """The definition of the symbol whose identifier is at `key`."""
+        path, line, character, name, kind, start_line, start_character, end_line, end_character = (
+            self.symbols[self.ids[key]]
+        )
+        return Symbol.model_validate(
+            {
+                "name": name,
+                "kind": kind,
+                "identifier_position": {
+                    "path": path,
+                    "position": {"line": line, "character": character},
+                },
+                "range": {
+                    "path": path,
+                    "start": {"line": start_line, "character": start_character},
+                    "end": {"line": end_line, "character": end_character},
+                },
+            }
+        )
+
+    def dependents(self, key: Tuple[str, int, int]) -> List[Tuple[str, int, int]]:
+        """The keys of the symbols that reference the symbol at `key`."""
+        node_id = self.ids[key]
+        return [
+            tuple(self.symbols[dependent][:3])
+            for dependent in self.targets[self.offsets[node_id] : self.offsets[node_id + 1]]
+        ]
+
+    @classmethod
+    def build(cls, index: WorkspaceIndex) -> "ReverseCallGraph":
+        """
+        Work the graph out from an index, without any more requests to lsproxy.
+
+        Each file's references are sorted by position, so the ones inside a symbol's range are found
+        with two binary searches.
+        """
+        records, ids = [], {}
+        for symbols in index.symbols_by_file.values():
+            for symbol in symbols:
+                key = symbol.identifier_position.as_tuple
+                if key not in ids:
+                    ids[key] = len(records)
+                    start, end = symbol.range.start, symbol.range.end
+                    records.append(
+                        key + (symbol.name, symbol.kind, start.line, start.character, end.line, end.character)
+                    )
+
+        # path -> sorted [(line, character, ID of the symbol referenced there)]
+        references_by_file = {}
+        for key, refs in index.references.items():
+            if key in ids:
+                for ref in refs:
+                    references_by_file.setdefault(ref.path, []).append(
+                        (ref.position.line, ref.position.character, ids[key])
+                    )
+        for refs in references_by_file.values():
+            refs.sort()
+
+        dependents = [set() for _ in records]
+        for file, symbols in index.symbols_by_file.items():
+            refs = references_by_file.get(file)
+            if not refs:
+                continue
+            for symbol in symbols:
+                dependent = ids[symbol.identifier_position.as_tuple]
+                start, end = symbol.range.start, symbol.range.end
+                # Both ends of the range are inclusive, like FileRange.contains
+                first = bisect_left(refs, (start.line, start.character))
+                last = bisect_right(refs, (end.line, end.character, float("inf")))
+                for _, _, referenced in refs[first:last]:
+                    if referenced != dependent:
+                        dependents[referenced].add(dependent)
+
+        offsets, targets = [0], []
+        for symbol_dependents in dependents:
+            targets.extend(sorted(symbol_dependents))
+            offsets.append(len(targets))
+        return cls(records, offsets, targets, index.modified_times)
+
+    def save(self, path: str):
+        """Write the graph to a gzipped JSON file, replacing it atomically."""
+        data = {
+            "symbols": self.symbols,
+            "offsets": self.offsets.tolist(),
+            "targets": self.targets.tolist(),
+            "modified_times": self.modified_times,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        partial_path = f"{path}.partial"
+        with gzip.open(partial_path, "wt", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(partial_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "ReverseCallGraph":
+        """Read a graph written by `save`."""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(
+            [tuple(record) for record in data["symbols"]],
+            data["offsets"],
+            data["targets"],
+            data.get("modified_times"),
+        )
+
+
+class CurrentCallGraph:
+    """
+    A `ReverseCallGraph` as of the current state of `workspace`: symbols in files edited since the
+    graph was built aren't in it, so callers find their dependents some other way.
+    """
+
+    def __init__(self, graph: ReverseCallGraph, workspace: "Workspace"):
+        self.graph = graph
+        self.workspace = workspace
+
+    def __len__(self):
+        return len(self.graph)
+
+    def __contains__(self, key: Tuple[str, int, int]):
+        return key in self.graph and _is_current(self.graph.modified_times, key[0], self.workspace)
+
+    def symbol(self, key: Tuple[str, int, int]) -> Symbol:
+        return self.graph.symbol(key)
+
+    def dependents(self, key: Tuple[str, int, int]) -> List[Tuple[str, int, int]]:
+        return self.graph.dependents(key)
+
+
+# path -> Future of what was loaded from it, for `load_in_background`
+_background_loads: Dict[str, Future] = {}
+_background_loads_lock = threading.Lock()
+_background_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="workspace_index")
+
+
+def load_in_background(path: str, load: Callable[[str], Any], keep: int = 4) -> Any:
+    """
+    What `load(path)` returns, loaded once per process on a background thread.
+
+    Returns None while it's loading, if it failed, or if there's no file at `path` yet (it's looked for
+    again on the next call). Only the `keep` most recently requested paths are kept in memory.
+    """
+    with _background_loads_lock:
+        future = _background_loads.pop(path, None)
+        if future is None:
+            if not os.path.exists(path):
+                return None
+            future = _background_loader.submit(load, path)
+        # Most recently requested last, so the oldest are dropped first
+        _background_loads[path] = future
+        while len(_background_loads) > keep:
+            del _background_loads[next(iter(_background_loads))]
+    if not future.done() or future.exception() is not None:
+        return None
+    return future.result()
+
+
+def wait_for_server(client, timeout: float):
+    """Poll lsproxy until it answers, for at most `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return client.list_files()
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-url", default=os.environ.get("BASE_URL", "http://localhost:4444/v1"))
+    parser.add_argument("--workspace", default=os.environ.get("CHECKOUT_LOCATION"))
+    parser.add_argument("--cache-dir", default=default_cache_dir())
+    parser.add_argument("--workers", type=int, default=16, help="Concurrent requests to lsproxy")
+    parser.add_argument(
+        "--wait", type=float, default=600, help="Seconds to wait for lsproxy to come up"
+    )
+    args = parser.parse_args()
+
+    def log(message):
+        print(f"[workspace_index] {message}", file=sys.stderr, flush=True)
+
+    version = workspace_version(args.workspace) if args.workspace else None
+    if version is None:
+        log("Workspace isn't a git checkout, so there's no version to key the index by")
+        return 1
+    path = index_path(args.cache_dir, version)
+    graph_path = call_graph_path(args.cache_dir, version)
+    if os.path.exists(path) and os.path.exists(graph_path):
+        log(f"Index for {version} already exists at {path}")
+        return 0
+
+    if os.path.exists(path):
+        index = WorkspaceIndex.load(path)
+    else:
+        client = PooledLsproxy(base_url=args.base_url, pool_size=args.workers)
+        wait_for_server(client, args.wait)
+        started = time.monotonic()
+
+        def save_counts(symbols_by_file, modified_times):
+            # The tutorial's file dropdowns only need the symbol counts, so save those as soon as they're known
+            counts = count_symbols(symbols_by_file, modified_times)
+            save_file_options(file_options_path(args.cache_dir, version), counts)
+            log(f"Counted symbols in {len(counts)} files")
+
+        index = WorkspaceIndex.build(
+            client, args.workspace, max_workers=args.workers, log=log, on_symbols=save_counts
+        )
+        index.save(path)
+        log(f"Indexed {len(index.files)} files in {time.monotonic() - started:.0f}s, saved to {path}")
+
+    call_graph = ReverseCallGraph.build(index)
+    call_graph.save(graph_path)
+    log(f"Saved the call graph of {len(call_graph)} symbols to {graph_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())